@@ -3,7 +3,8 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
-import sqlite3, bcrypt, json, requests
+import os, sqlite3, json, tempfile
+import archive, auth, bulk_io, db, menu_optimizer, metrics, nutrition_history, off_cache, off_client, plan_engine, tdee_estimator, weight_history, workout_catalog, write_queue
 from datetime import datetime, timedelta, date
 
 st.set_page_config(
@@ -44,45 +45,145 @@ def load_lang():
     return {"en": en, "tr": tr}
 L = load_lang()
 
+@st.cache_data
+def load_workouts():
+    """The workout catalog, validated against both languages once per process."""
+    return workout_catalog.load(workout_catalog.CATALOG_PATH, load_lang())
+W = load_workouts()
+
 def T(key):
     lang = st.session_state.get("lang", "en")
     return L[lang].get(key, key)
 
 # ---------- Database ----------
-def get_conn():
-    conn = sqlite3.connect("carioca_v2.db", check_same_thread=False)
-    conn.execute("""CREATE TABLE IF NOT EXISTS users(
-        username TEXT PRIMARY KEY,
-        pw_hash BLOB NOT NULL,
-        lang TEXT DEFAULT 'en',
-        theme TEXT DEFAULT 'tropical',
-        plan_type TEXT DEFAULT 'full_body',
-        meal_structure TEXT DEFAULT 'two_plus_one',
-        age INT, sex TEXT, height_cm REAL, weight_kg REAL, bodyfat REAL,
-        activity TEXT, target_weight REAL, training_days INT, fasting TEXT,
-        created_at TEXT
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS weights(
-        username TEXT, dt TEXT, weight REAL
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS food_logs(
-        username TEXT, dt TEXT, food_name TEXT, grams REAL,
-        kcal REAL, protein REAL, carbs REAL, fat REAL
-    )""")
-    conn.commit()
-    return conn
-
-conn = get_conn()
+metrics.install()
+
+@st.cache_resource
+def get_db():
+    return db.Database()
+
+conn = get_db().session_conn(st.session_state)
+
+@st.cache_resource
+def get_writer():
+    # new food_logs rows are folded into the nutrition rollups once per committed batch
+    return write_queue.WriteQueue(get_db().path, batch_hook=nutrition_history.folding)
+
+# ---------- Reruns ----------
+# Interactions inside a fragment rerun only that fragment, not the whole script.
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", lambda f: f)
+
+def data_version(table: str) -> int:
+    return st.session_state.setdefault("_data_ver", {}).get(table, 0)
+
+def touch(table: str):
+    """Mark a table as written by this session so memoized reads of it recompute."""
+    ver = st.session_state.setdefault("_data_ver", {})
+    ver[table] = ver.get(table, 0) + 1
+
+def memo(name: str, key, compute):
+    """Session-scoped memo: `compute()` runs again only when `key` changes."""
+    slot = st.session_state.setdefault("_memo", {})
+    hit = slot.get(name)
+    if hit is None or hit[0] != key:
+        hit = slot[name] = (key, compute())
+    return hit[1]
+
+def queue_write(table: str, statements, row: dict = None):
+    """Hand a write to the background writer; `row` is shown to this session until it commits."""
+    fut = get_writer().submit(statements)
+    st.session_state.setdefault("_pending", {}).setdefault(table, []).append((fut, row))
+    touch(table)
+
+def read_your_writes(table: str, key, read):
+    """Memoized `read()` of `table` plus this session's rows still waiting in the write queue.
+    Confirmed writes leave the pending list and force a re-read; failed ones are reported."""
+    pending = st.session_state.setdefault("_pending", {}).setdefault(table, [])
+    with get_writer().settled():
+        done = [p for p in pending if p[0].done()]
+        for p in done:
+            pending.remove(p)
+            if p[0].exception() is not None:
+                st.error(f"Could not save / Kaydedilemedi: {p[0].exception()}")
+        if done:
+            touch(table)
+        df = memo(table, (key, data_version(table)), read)
+        waiting = [row for _, row in pending if row is not None]
+    return df, waiting
 
 # ---------- Auth ----------
-def hash_pw(pw: str) -> bytes:
-    return bcrypt.hashpw(pw.encode(), bcrypt.gensalt())
-
-def check_pw(pw: str, pw_hash: bytes) -> bool:
+def client_ip():
+    """Address for the per-IP limiters, or None when unknown (registrations then share one
+    budget; logins keep the per-user limit). X-Forwarded-For is client-controlled, so it
+    counts only behind trusted proxies (CARIOCA_TRUSTED_PROXY_HOPS)."""
+    ctx = getattr(st, "context", None)
+    if ctx is None:
+        return None
+    if auth.TRUSTED_PROXY_HOPS:
+        return auth.forwarded_ip(ctx.headers.get("X-Forwarded-For"))
+    return getattr(ctx, "ip_address", None) or None
+
+def start_session(u: str, pw_hash, gen: int, lang: str):
+    st.session_state["user"] = u
+    if "lang" not in st.session_state:
+        st.session_state["lang"] = lang
+    # a reconnecting client presents this cookie instead of its password
+    st.session_state["_cookie"] = auth.issue_token(u, pw_hash, gen)
+
+def sync_cookie():
+    """Write (or, for "", delete) the session cookie queued by login, logout or a stale token."""
+    token = st.session_state.pop("_cookie", None)
+    if token is not None:
+        secure = str(getattr(getattr(st, "context", None), "url", "") or "").startswith("https:")
+        st.html(auth.cookie_script(token, secure), unsafe_allow_javascript=True)
+
+def resume_session():
+    """Log in from the signed session cookie without touching bcrypt."""
+    st.query_params.pop("session", None)    # tokens no longer travel in the URL
+    if st.session_state.get("_resume_tried"):
+        return
+    st.session_state["_resume_tried"] = True
+    ctx = getattr(st, "context", None)
+    token = getattr(ctx, "cookies", {}).get(auth.SESSION_COOKIE) if ctx is not None else None
+    if not token:
+        return
+    row = {}
+    def lookup(name):
+        row["r"] = conn.execute(db.USER_AUTH, (name,)).fetchone()
+        return (row["r"][0], row["r"][2]) if row["r"] else None
+    u = auth.token_user(token, lookup)
+    if u:
+        st.session_state["user"] = u
+        st.session_state.setdefault("lang", row["r"][1] or "en")
+    else:
+        st.session_state["_cookie"] = ""
+
+def login(u: str, p: str, lang: str):
+    ip = client_ip()
+    wait = auth.login_wait(u, ip)
+    if wait:
+        st.error(f"Too many attempts, try again in {int(wait) + 1}s / Çok fazla deneme")
+        return
+    row = conn.execute(db.USER_AUTH, (u,)).fetchone()
     try:
-        return bcrypt.checkpw(pw.encode(), pw_hash)
-    except Exception:
-        return False
+        ok, rehash = auth.verify(p, row[0]) if row else (False, False)
+    except auth.Busy:
+        st.warning("Server busy, please retry / Sunucu meşgul, tekrar deneyin")
+        return
+    auth.record_attempt(u, ip, ok)
+    if not ok:
+        st.error("Invalid credentials / Geçersiz bilgiler")
+        return
+    pw_hash = row[0]
+    if rehash:      # cost factor changed since this hash was made
+        try:
+            pw_hash = auth.hash_password(p)
+            conn.execute(db.USER_SET_PASSWORD, (pw_hash, u))
+            conn.commit()
+        except auth.Busy:
+            pw_hash = row[0]
+    start_session(u, pw_hash, row[2], row[1] or lang)
+    st.rerun()
 
 def login_register_ui():
     st.sidebar.header("Carioca 🌴")
@@ -92,37 +193,51 @@ def login_register_ui():
         u = st.text_input(T("username"))
         p = st.text_input(T("password"), type="password")
         if st.button(T("login"), use_container_width=True):
-            row = conn.execute("SELECT pw_hash, lang FROM users WHERE username=?", (u,)).fetchone()
-            if row and check_pw(p, row[0]):
-                st.session_state["user"] = u
-                if "lang" not in st.session_state:
-                    st.session_state["lang"] = row[1] or lang
-                st.experimental_rerun()
-            else:
-                st.error("Invalid credentials / Geçersiz bilgiler")
+            login(u, p, lang)
     with tab_register:
         u = st.text_input(T("username")+" *", key="ru")
         p = st.text_input(T("password")+" *", type="password", key="rp")
         if st.button(T("register"), use_container_width=True):
+            wait = auth.register_wait(client_ip()) if u and p else 0
             if not u or not p:
                 st.warning("Fill required fields")
+            elif wait:
+                st.error(f"Too many attempts, try again in {int(wait) + 1}s / Çok fazla deneme")
             else:
                 try:
-                    conn.execute("INSERT INTO users(username, pw_hash, lang, created_at) VALUES(?,?,?,?)",
-                                 (u, hash_pw(p), lang, datetime.utcnow().isoformat()))
+                    conn.execute(db.USER_INSERT, (u, auth.hash_password(p), lang, datetime.utcnow().isoformat()))
                     conn.commit()
                     st.success("Registered. Please log in.")
                 except sqlite3.IntegrityError:
                     st.error("Username already exists")
+                except auth.Busy:
+                    st.warning("Server busy, please retry / Sunucu meşgul, tekrar deneyin")
 
+if "user" not in st.session_state:
+    resume_session()
+sync_cookie()
 if "user" not in st.session_state:
     login_register_ui()
     st.stop()
 
 # ---------- Load user ----------
 user = st.session_state["user"]
-row = conn.execute("SELECT username, lang, theme, plan_type, meal_structure, age, sex, height_cm, weight_kg, bodyfat, activity, target_weight, training_days, fasting FROM users WHERE username=?", (user,)).fetchone()
-(u, lang, theme, plan_type, meal_structure, age, sex, height_cm, weight_kg, bodyfat, activity, target_weight, training_days, fasting) = row
+PROFILE_DEFAULTS = {"plan_type": "full_body", "meal_structure": "two_plus_one", "age": 34, "sex": "male",
+                    "height_cm": 180, "weight_kg": 94.0, "bodyfat": 27.0, "activity": "light",
+                    "target_weight": 82.0, "training_days": 5}
+
+def load_profile():
+    row = conn.execute(db.USER_PROFILE, (user,)).fetchone()
+    cols = ["username", "lang", "theme", "plan_type", "meal_structure", "age", "sex", "height_cm", "weight_kg",
+            "bodyfat", "activity", "target_weight", "training_days", "fasting"]
+    prof = dict(zip(cols, row))
+    for k, v in PROFILE_DEFAULTS.items():
+        if not prof.get(k):
+            prof[k] = v
+    return prof
+
+profile = memo("profile", (user, data_version("users")), load_profile)
+theme = profile["theme"]
 
 # ---------- Theme toggle UI ----------
 st.session_state.setdefault("theme", theme or "tropical")
@@ -135,101 +250,140 @@ else:
     st.markdown(css_minimal(), unsafe_allow_html=True)
 
 st.title(f"🌴 Carioca v2 — {user}")
-st.caption("Personalized plan engine • Theme toggle • OpenFoodFacts live search")
+st.caption("Personalized plan engine • Theme toggle • OpenFoodFacts search")
 
 # ---------- Sidebar language + logout ----------
 if st.sidebar.button(T("logout")):
+    conn.execute(db.USER_REVOKE_TOKENS, (user,))   # every token issued so far stops working
+    conn.commit()
     st.session_state.clear()
-    st.experimental_rerun()
+    st.session_state["_cookie"] = ""
+    st.rerun()
 st.session_state.setdefault("lang", st.session_state.get("lang", "en"))
 st.sidebar.radio(T("language"), ["en","tr"], key="lang", format_func=lambda x: "English" if x=="en" else "Türkçe")
 
-# ---------- Helper Calcs ----------
-def mifflin_st_jeor(sex:str, weight, height_cm, age):
-    if sex == "male":
-        return 10*weight + 6.25*height_cm - 5*age + 5
-    else:
-        return 10*weight + 6.25*height_cm - 5*age - 161
-
-def activity_factor(level:str):
-    return {"sedentary":1.2,"light":1.35,"moderate":1.55,"high":1.75,"very_high":1.95}.get(level, 1.35)
-
-def macro_split(cal, workout=True, weight=80):
-    protein_g = round(2.0 * weight)           # ~2g/kg
-    carbs_g = round((1.8 if workout else 0.8) * weight)
-    fats_kcal = cal - (protein_g*4 + carbs_g*4)
-    fat_g = max(0, round(fats_kcal/9))
-    return protein_g, carbs_g, fat_g
-
-# ---------- Tabs ----------
-tabs = st.tabs([T("profile"), T("deficit_calc"), T("nutrition"), T("workout"), T("progress")])
+# ---------- Plan targets ----------
+def profile_targets(p=None, tdee=None):
+    """Targets for the saved profile come from the stored `user_targets` row (kept current by
+    saves and the nightly `plan_engine.py recompute`); pass `p` to preview unsaved values and
+    `tdee` to base them on a measured TDEE instead of the formula."""
+    src = p or profile
+    args = (src["sex"], src["weight_kg"], src["height_cm"], src["age"], src["activity"])
+    if p is not None:
+        return memo("targets_preview", (args, tdee), lambda: plan_engine.targets_for(*args, tdee=tdee))
+    key = plan_engine.inputs_key(*args)
+    return memo("targets", (user, key), lambda: plan_engine.load(conn, user, key) or plan_engine.targets_for(*args))
+
+def save_targets(sex, weight_kg, height_cm, age, activity):
+    users = pd.DataFrame([dict(zip(plan_engine.INPUTS, (sex, weight_kg, height_cm, age, activity)))], index=[user])
+    plan_engine.store(conn, users, plan_engine.targets(users))
+
+def tdee_estimate():
+    """Adaptive TDEE from logged intake and weigh-ins, or None until there is enough of both."""
+    today = date.today()
+    def compute():
+        nutrition_history.refresh(conn)
+        return tdee_estimator.update(conn, user, profile_targets()["tdee_mean"], today)
+    est = memo("tdee_estimate", (user, today, data_version("food_logs"), data_version("weights")), compute)
+    return est if tdee_estimator.usable(est) else None
+
+def plan_targets():
+    """The targets every section shows and compares intake against: based on the adaptive TDEE
+    once it is usable, the stored formula targets until then."""
+    est = tdee_estimate()
+    return profile_targets() if est is None else profile_targets(profile, round(est["tdee"]))
+
+def is_workout_day(d: date) -> bool:
+    return d.weekday() in plan_engine.WORKOUT_WEEKDAYS
+
+def is_workout_today():
+    return is_workout_day(date.today())
 
 # ---------- PROFILE TAB ----------
-with tabs[0]:
+@fragment
+@metrics.timed("section_seconds", section="profile")
+def profile_tab():
     col1, col2, col3 = st.columns(3)
     with col1:
-        age = st.number_input(T("age"), min_value=10, max_value=100, value=int(age) if age else 34)
-        sex = st.selectbox(T("sex"), ["male","female"], index=0 if (sex or "male")=="male" else 1, format_func=lambda x: T(x))
-        height_cm = st.number_input(T("height_cm"), min_value=120, max_value=230, value=int(height_cm) if height_cm else 180)
+        age = st.number_input(T("age"), min_value=10, max_value=100, value=int(profile["age"]))
+        sex = st.selectbox(T("sex"), ["male","female"], index=0 if profile["sex"]=="male" else 1, format_func=lambda x: T(x))
+        height_cm = st.number_input(T("height_cm"), min_value=120, max_value=230, value=int(profile["height_cm"]))
     with col2:
-        weight_kg = st.number_input(T("weight_kg"), min_value=30.0, max_value=250.0, value=float(weight_kg) if weight_kg else 94.0, step=0.1)
-        bodyfat = st.number_input(T("bodyfat_pct"), min_value=0.0, max_value=60.0, value=float(bodyfat) if bodyfat else 27.0, step=0.1)
-        target_weight = st.number_input(T("target_weight"), min_value=30.0, max_value=250.0, value=float(target_weight) if target_weight else 82.0, step=0.1)
+        weight_kg = st.number_input(T("weight_kg"), min_value=30.0, max_value=250.0, value=float(profile["weight_kg"]), step=0.1)
+        bodyfat = st.number_input(T("bodyfat_pct"), min_value=0.0, max_value=60.0, value=float(profile["bodyfat"]), step=0.1)
+        target_weight = st.number_input(T("target_weight"), min_value=30.0, max_value=250.0, value=float(profile["target_weight"]), step=0.1)
     with col3:
         activity = st.selectbox(T("activity"), ["sedentary","light","moderate","high","very_high"],
-                                index=["sedentary","light","moderate","high","very_high"].index(activity or "light"),
+                                index=["sedentary","light","moderate","high","very_high"].index(profile["activity"]),
                                 format_func=lambda x: T(x))
-        training_days = st.slider(T("training_days"), 1, 7, int(training_days) if training_days else 5)
+        training_days = st.slider(T("training_days"), 1, 7, int(profile["training_days"]))
         fasting = st.selectbox(T("fasting"), [T("fasting_16_8")])
 
     # Plan preferences
     st.subheader(T("plan_engine"))
     colp1, colp2 = st.columns(2)
     with colp1:
-        plan_type = st.selectbox(T("plan_type"), ["full_body","ppl","upper_lower","cardio_core"], index=["full_body","ppl","upper_lower","cardio_core"].index(plan_type or "full_body"),
+        plans = list(W["plans"])
+        plan_type = st.selectbox(T("plan_type"), plans, index=plans.index(profile["plan_type"]) if profile["plan_type"] in plans else 0,
                                  format_func=lambda x: T(x))
     with colp2:
-        meal_structure = st.selectbox(T("meal_structure"), ["two_plus_one","three_meals","four_meals"], index=["two_plus_one","three_meals","four_meals"].index(meal_structure or "two_plus_one"),
+        meal_structure = st.selectbox(T("meal_structure"), ["two_plus_one","three_meals","four_meals"], index=["two_plus_one","three_meals","four_meals"].index(profile["meal_structure"]),
                                       format_func=lambda x: T(x))
 
     if st.button(T("save"), type="primary"):
-        conn.execute("""UPDATE users SET lang=?, theme=?, plan_type=?, meal_structure=?, age=?, sex=?, height_cm=?, weight_kg=?, bodyfat=?, activity=?, target_weight=?, training_days=?, fasting=? WHERE username=?""",
+        conn.execute(db.USER_UPDATE,
                      (st.session_state["lang"], st.session_state["theme"], plan_type, meal_structure, age, sex, height_cm, weight_kg, bodyfat, activity, target_weight, training_days, fasting, user))
+        save_targets(sex, weight_kg, height_cm, age, activity)
         conn.commit()
-        st.success(T("update"))
-
-    # Computed metrics with 25% default deficit
-    bmr = mifflin_st_jeor(sex, weight_kg, height_cm, age)
-    tdee = bmr * activity_factor(activity)
-    wcal = round(tdee * 0.75)  # 25% deficit
-    rcal = round((bmr*1.35) * 0.75)
-
-    pc_w, cc_w, fc_w = macro_split(wcal, workout=True, weight=weight_kg)
-    pc_r, cc_r, fc_r = macro_split(rcal, workout=False, weight=weight_kg)
+        touch("users")
+        st.session_state["flash"] = T("update")
+        st.rerun()   # other sections read the saved profile
+    if "flash" in st.session_state:
+        st.success(st.session_state.pop("flash"))
+
+    # Computed metrics with 25% default deficit, from the same TDEE as plan_targets()
+    est = tdee_estimate()
+    edited = {"sex": sex, "weight_kg": weight_kg, "height_cm": height_cm, "age": age, "activity": activity}
+    t = profile_targets(edited, est and round(est["tdee"]))
+    pc_w, cc_w, fc_w = t["macros_w"]
+    pc_r, cc_r, fc_r = t["macros_r"]
 
     st.subheader("📊 Metrics")
     c1,c2,c3,c4 = st.columns(4)
-    c1.metric(T("bmr"), f"{int(bmr)} {T('kcal')}")
-    c2.metric(T("tdee"), f"{int(tdee)} {T('kcal')}")
-    c3.metric(T("workout_day_calories"), f"{wcal} {T('kcal')}")
-    c4.metric(T("rest_day_calories"), f"{rcal} {T('kcal')}")
+    c1.metric(T("bmr"), f"{int(t['bmr'])} {T('kcal')}")
+    c2.metric(T("tdee"), f"{int(t['tdee'])} {T('kcal')}")
+    if est:
+        c2.caption(f"{T('tdee_adaptive')}: {int(est['tdee'])} ±{int(est['sd'])} {T('kcal')}, {est['intake_days']} {T('days_logged')}")
+    c3.metric(T("workout_day_calories"), f"{t['wcal']} {T('kcal')}")
+    c4.metric(T("rest_day_calories"), f"{t['rcal']} {T('kcal')}")
 
     st.write(T("macros")+":")
     st.write(f"🏋️ {T('workout_day')}: P {pc_w}g / C {cc_w}g / F {fc_w}g")
     st.write(f"🛌 {T('rest_day')}: P {pc_r}g / C {cc_r}g / F {fc_r}g")
+    if est:
+        st.caption(T("targets_adaptive"))
+    if any(edited[k] != profile[k] for k in plan_engine.INPUTS):
+        st.caption(T("targets_preview"))
 
 # ---------- DEFICIT CALCULATOR TAB ----------
-with tabs[1]:
+@fragment
+@metrics.timed("section_seconds", section="deficit_calc")
+def deficit_tab():
     st.subheader(T("deficit_calc"))
-    # access previously computed bmr etc. from profile tab scope
     try:
         day_type = st.selectbox(T("day_type"), [T("workout_day"), T("rest_day")])
         deficit = st.slider(T("deficit_percent"), 5, 35, 25, step=1)
-        base_tdee = bmr*activity_factor(activity) if day_type==T("workout_day") else bmr*1.35
-        target_cal = round(base_tdee * (1 - deficit/100))
-        weekly_loss = round(((base_tdee - target_cal) * 7) / 7700, 2)
-        weight_3m = round(weight_kg - weekly_loss * 12, 1)
+        # every deficit step for both day types in one vectorized pass; the slider just picks a row
+        users = pd.DataFrame([{k: profile[k] for k in plan_engine.INPUTS}])
+        est = tdee_estimate()
+        tdee = est and round(est["tdee"])
+        grid = memo("deficit_grid", (tuple(users.iloc[0]), tdee),
+                    lambda: plan_engine.deficit_scenarios(users, range(5, 36), tdee=None if tdee is None else [tdee]))
+        sc = grid[(grid["day_type"] == ("workout" if day_type==T("workout_day") else "rest")) & (grid["deficit"] == deficit)].iloc[0]
+        base_tdee, target_cal, weekly_loss, weight_3m = sc["base_tdee"], sc["target_cal"], sc["weekly_loss"], sc["weight_end"]
         st.metric(T("tdee"), f"{int(base_tdee)} {T('kcal')}")
+        if est:
+            st.caption(f"{T('tdee_adaptive')}: {int(est['tdee'])} ±{int(est['sd'])} {T('kcal')}, {est['intake_days']} {T('days_logged')}")
         st.metric(T("target_cal"), f"{int(target_cal)} {T('kcal')}")
         st.metric(T("weekly_loss"), f"{weekly_loss} kg")
         st.metric(T("three_months_weight"), f"{weight_3m} kg")
@@ -237,34 +391,22 @@ with tabs[1]:
         st.info("Fill profile first")
 
 # ---------- OpenFoodFacts Helpers ----------
-@st.cache_data(ttl=30)
+@st.cache_resource
+def get_off_cache():
+    return off_cache.TieredCache()
+
 def off_search(query: str, lang_code: str = "en", page_size: int = 20):
-    try:
-        url = "https://world.openfoodfacts.org/cgi/search.pl"
-        params = {"search_terms":query,"search_simple":1,"action":"process","json":1,"page_size":page_size,"cc":"world"}
-        r = requests.get(url, params=params, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        prods = data.get("products", [])
-        rows = []
-        for p in prods:
-            nutr = p.get("nutriments", {}) or {}
-            kcal = nutr.get("energy-kcal_100g"); prot = nutr.get("proteins_100g")
-            carbs = nutr.get("carbohydrates_100g"); fat = nutr.get("fat_100g")
-            if None in (kcal, prot, carbs, fat): continue
-            name = p.get(f"product_name_{lang_code}") or p.get("product_name") or p.get(f"generic_name_{lang_code}") or p.get("generic_name") or "Unnamed"
-            brand = p.get("brands","")
-            rows.append({"name":name,"brand":brand,"kcal_100g":float(kcal),"protein_100g":float(prot),"carbs_100g":float(carbs),"fat_100g":float(fat)})
-        return pd.DataFrame(rows)
-    except Exception:
-        return pd.DataFrame()
+    with metrics.timer("off_search_seconds"):
+        return pd.DataFrame(off_client.search(query, lang_code, page_size, cache=get_off_cache()))
 
 def macros_from_grams(row, grams: float):
     factor = grams / 100.0
     return (row["kcal_100g"]*factor, row["protein_100g"]*factor, row["carbs_100g"]*factor, row["fat_100g"]*factor)
 
 # ---------- NUTRITION TAB ----------
-with tabs[2]:
+@fragment
+@metrics.timed("section_seconds", section="food_search")
+def food_search_section():
     st.subheader(T("log_food"))
     colA, colB, colC = st.columns([3,1,1])
     with colA:
@@ -273,7 +415,7 @@ with tabs[2]:
         grams = st.number_input(T("amount_g"), min_value=1, max_value=2000, value=100)
     with colC:
         lang_pick = st.radio(T("language"), ["en","tr"], horizontal=True, key="food_lang", format_func=lambda x: "English" if x=="en" else "Türkçe")
-    df = off_search(q, "tr" if lang_pick=="tr" else "en") if q else pd.DataFrame()
+    df = memo("food_search", (q, lang_pick), lambda: off_search(q, "tr" if lang_pick=="tr" else "en") if q else pd.DataFrame())
     st.caption(T("api_results"))
     if df.empty and q:
         st.warning(T("no_results") + " — " + T("search_tip"))
@@ -283,172 +425,235 @@ with tabs[2]:
         if st.button(T("add")):
             rowf = df.iloc[int(sel_idx)]
             kcal, p, c, f = macros_from_grams(rowf, grams)
-            conn.execute("INSERT INTO food_logs(username, dt, food_name, grams, kcal, protein, carbs, fat) VALUES(?,?,?,?,?,?,?,?)",
-                        (user, date.today().isoformat(), rowf['name'], grams, float(kcal), float(p), float(c), float(f)))
-            conn.commit()
-            st.success(T("added"))
-    st.divider()
-
-    # Planned menu generator (uses OFF staples; if no network, it still runs with zeros handled)
+            entry = {"food_name": rowf['name'], "grams": grams, "kcal": float(kcal), "protein": float(p), "carbs": float(c), "fat": float(f)}
+            queue_write("food_logs", [(db.FOOD_LOG_INSERT, (user, date.today().isoformat(), entry["food_name"], grams,
+                                                            entry["kcal"], entry["protein"], entry["carbs"], entry["fat"]))],
+                        entry)
+            st.session_state["flash_food"] = T("added")
+            st.rerun()   # refresh today's log below
+    if "flash_food" in st.session_state:
+        st.success(st.session_state.pop("flash_food"))
+
+def menu_lines(plan):
+    lines = []
+    for i, meal in enumerate(plan["meals"]):
+        meal_name = f"Meal {i+1}" if st.session_state["lang"]=="en" else f"Öğün {i+1}"
+        lines.append(f"- **{meal_name}**: " + " + ".join(f"{g} g {name}" for name, g in meal["items"]))
+    p, c, f, kcal = plan["actual"]
+    tp, tc, tf, tk = plan["target"]
+    lines.append(f"\n_{T('day_total')}: {int(kcal)}/{int(tk)} {T('kcal')}, P {int(p)}/{int(tp)}g / C {int(c)}/{int(tc)}g / F {int(f)}/{int(tf)}g_")
+    return "\n".join(lines)
+
+@fragment
+@metrics.timed("section_seconds", section="menu")
+def menu_section():
+    # Planned menu generator: macro-targeted solver over the OFF staples pool
     st.subheader(T("menu_suggestion"))
+    whole_week = st.checkbox(T("whole_week"), key="menu_week")
     if st.button(T("generate_menu")):
-        # Determine targets by day
-        weekday = date.today().weekday()
-        is_workout = weekday in [0,2,4]
-        target = (round((mifflin_st_jeor(sex, weight_kg, height_cm, age)*activity_factor(activity))*0.75) if is_workout else round((mifflin_st_jeor(sex, weight_kg, height_cm, age)*1.35)*0.75))
-        p_target, c_target, f_target = (macro_split(target, workout=is_workout, weight=weight_kg))
+        t = plan_targets()
+        meal_structure = profile["meal_structure"]
         # Try to fetch staples
         staples = ["chicken breast","rice","oats","egg","yogurt","almonds","olive oil","banana","broccoli"]
-        pool = pd.concat([off_search(s, "tr" if lang_pick=="tr" else "en", page_size=3) for s in staples], ignore_index=True)
+        found, missing = off_client.search_many(staples, st.session_state.get("food_lang", "en"), page_size=3,
+                                                cache=get_off_cache(), deadline=12.0)
+        pool = pd.DataFrame([r for s in staples for r in found.get(s, [])])
+        if missing and not pool.empty:
+            st.caption("Skipped (slow/unavailable): " + ", ".join(missing))
         if pool.empty:
             st.warning("OFF unavailable right now; try again.")
         else:
-            # pick representatives
-            choose = lambda df, key: df.sort_values(by=key, ascending=False).head(1).iloc[0]
-            p_food = choose(pool, "protein_100g")   # protein source
-            c_food = choose(pool, "carbs_100g")     # carb source
-            f_food = choose(pool, "fat_100g")       # fat source
-            # split calories by structure a bit differently
-            if meal_structure == "two_plus_one":
-                splits = [0.45, 0.45, 0.10]
-            elif meal_structure == "three_meals":
-                splits = [0.35, 0.35, 0.30]
+            days = [date.today() + timedelta(days=i) for i in range(7 if whole_week else 1)]
+            workout = [is_workout_day(d) for d in days]
+            day_targets = [(t["wcal"], t["macros_w"]) if w else (t["rcal"], t["macros_r"]) for w in workout]
+            plans = menu_optimizer.plan_week(pool, day_targets, meal_structure)
+            if whole_week:
+                st.markdown("\n\n".join(f"**{d.isoformat()} — {T('workout_day') if w else T('rest_day')}**\n\n{menu_lines(p)}"
+                                          for d, w, p in zip(days, workout, plans)))
             else:
-                splits = [0.30, 0.30, 0.20, 0.20]  # 4 meals -> extra line
-            # grams calculator
-            def grams_for_cals(row, cals): return int(cals / max(row["kcal_100g"]/100.0, 0.01))
-            # build text
-            remaining = target
-            lines = []
-            parts = len(splits)
-            for i, spli in enumerate(splits):
-                cals = target * spli
-                gp = grams_for_cals(p_food, cals*0.5)
-                gc = grams_for_cals(c_food, cals*0.35)
-                gf = grams_for_cals(f_food, cals*0.15)
-                meal_name = f"Meal {i+1}" if st.session_state["lang"]=="en" else f"Öğün {i+1}"
-                lines.append(f"- **{meal_name}**: {gp} g {p_food['name']} + {gc} g {c_food['name']} + {gf} g {f_food['name']}")
-            st.markdown("\n".join(lines))
-
+                st.markdown(menu_lines(plans[0]))
+
+def today_log():
+    """Today's rows (committed + still queued) and their totals."""
+    logs, waiting = read_your_writes("food_logs", (user, date.today()),
+                                     lambda: pd.read_sql_query(db.FOOD_LOG_DAY, conn, params=(user, date.today().isoformat())))
+    if waiting:
+        logs = pd.concat([logs, pd.DataFrame(waiting)], ignore_index=True)
+    totals = logs[["kcal","protein","carbs","fat"]].sum() if not logs.empty else pd.Series({"kcal":0,"protein":0,"carbs":0,"fat":0})
+    return logs, totals
+
+@fragment
+@metrics.timed("section_seconds", section="today_log")
+def today_log_section():
     # Today's log & remaining
     st.subheader(T("today_log"))
-    logs = pd.read_sql_query("SELECT food_name, grams, kcal, protein, carbs, fat FROM food_logs WHERE username=? AND dt=?",
-                             conn, params=(user, date.today().isoformat()))
+    logs, totals = today_log()
     if logs.empty:
         st.info("No entries yet / Kayıt yok")
-        totals = pd.Series({"kcal":0,"protein":0,"carbs":0,"fat":0})
     else:
-        totals = logs[["kcal","protein","carbs","fat"]].sum()
         st.dataframe(logs, use_container_width=True)
         st.write(f"**{T('total')}**: {int(totals['kcal'])} {T('kcal')}, P {int(totals['protein'])}g / C {int(totals['carbs'])}g / F {int(totals['fat'])}g")
     # Targets compare
-    weekday = date.today().weekday(); is_workout = weekday in [0,2,4]
     try:
-        target = (round((mifflin_st_jeor(sex, weight_kg, height_cm, age)*activity_factor(activity))*0.75) if is_workout else round((mifflin_st_jeor(sex, weight_kg, height_cm, age)*1.35)*0.75))
-        pc, cc, fc = (macro_split(target, workout=is_workout, weight=weight_kg))
+        is_workout = is_workout_today()
+        t = plan_targets()
+        target = t["wcal"] if is_workout else t["rcal"]
+        pc, cc, fc = t["macros_w"] if is_workout else t["macros_r"]
         st.write(f"**{T('remaining')}**: {int(target - totals['kcal'])} {T('kcal')}, P {max(0,pc-int(totals['protein']))}g / C {max(0,cc-int(totals['carbs']))}g / F {max(0,fc-int(totals['fat']))}g")
-        fig = px.pie(values=[max(totals['protein'],1)*4, max(totals['carbs'],1)*4, max(totals['fat'],1)*9],
-                     names=[T('protein'), T('carbs'), T('fat')], title=T("macros"))
+        with metrics.timer("plotly_seconds", chart="macros"):
+            fig = px.pie(values=[max(totals['protein'],1)*4, max(totals['carbs'],1)*4, max(totals['fat'],1)*9],
+                         names=[T('protein'), T('carbs'), T('fat')], title=T("macros"))
         st.plotly_chart(fig, use_container_width=True)
     except Exception:
         pass
 
+@metrics.timed("section_seconds", section="nutrition")
+def nutrition_tab():
+    food_search_section()
+    st.divider()
+    menu_section()
+    today_log_section()
+
 # ---------- WORKOUT TAB ----------
-with tabs[3]:
+@st.cache_data(max_entries=512)
+def workout_block(plan_type: str, training_days: int, lang: str) -> str:
+    return workout_catalog.render(W, plan_type, training_days, L[lang])
+
+@metrics.timed("section_seconds", section="workout")
+def workout_tab():
     st.subheader(T("workout_plan"))
-    # Video links
-    vids = {
-        "Squat":"https://www.youtube.com/watch?v=aclHkVaku9U",
-        "Romanian Deadlift":"https://www.youtube.com/watch?v=Op6A_C2lH_0",
-        "Walking Lunge":"https://www.youtube.com/watch?v=wrwwXE_x-pQ",
-        "Bench Press":"https://www.youtube.com/watch?v=gRVjAtPip0Y",
-        "Barbell Row":"https://www.youtube.com/watch?v=YSx8umUqZ1I",
-        "Shoulder Press":"https://www.youtube.com/watch?v=qEwKCR5JCog",
-        "Plank":"https://www.youtube.com/watch?v=BQu26ABuVS0",
-        "Leg Raise":"https://www.youtube.com/watch?v=JB2oyawG9KI",
-        "Deadlift":"https://www.youtube.com/watch?v=op9kVnSso6Q",
-        "Pull-up":"https://www.youtube.com/watch?v=eGo4IYlbE5g",
-        "Lat Pulldown":"https://www.youtube.com/watch?v=CAwf7n6Luuc",
-        "Incline DB Press":"https://www.youtube.com/watch?v=8iPEnn-ltC8",
-        "Seated Row":"https://www.youtube.com/watch?v=GZbfZ033f74",
-        "Leg Press":"https://www.youtube.com/watch?v=IZxyjW7MPJQ",
-        "Leg Curl":"https://www.youtube.com/watch?v=1Tq3QdYUuHs",
-        "Calf Raise":"https://www.youtube.com/watch?v=YMmgqO8Jo-k",
-        "Side Plank":"https://www.youtube.com/watch?v=K2VljzCC16g",
-        "Heavy Bag Boxing":"https://www.youtube.com/watch?v=6k1k3JtGkC4",
-        "Treadmill Incline":"https://www.youtube.com/watch?v=2I3ne9CwCWA"
-    }
-
-    def show_ex(name, sets_reps):
-        url = vids.get(name)
-        st.markdown(f"- **{name}** — {sets_reps}  |  [{T('video_guide')}]({url})")
-
-    if plan_type == "full_body":
-        st.write("**Mon / Wed / Fri — Full Body**")
-        show_ex("Squat","4x8")
-        show_ex("Romanian Deadlift","3x10")
-        show_ex("Walking Lunge","2x20")
-        show_ex("Bench Press","4x8")
-        show_ex("Barbell Row","4x10")
-        show_ex("Shoulder Press","3x12")
-        show_ex("Plank","3 sets (max)")
-        show_ex("Leg Raise","3x15")
-        show_ex("Treadmill Incline","10 min finisher")
-        st.subheader(T("rest_cardio"))
-        st.write("**Tue / Thu / Sat — Cardio + Core**")
-        show_ex("Treadmill Incline","30–40 min")
-        show_ex("Heavy Bag Boxing","3 x 3 min (1 min rest)")
-        show_ex("Side Plank","3x30s/side")
-
-    elif plan_type == "ppl":
-        st.write("**Mon: Push**")
-        show_ex("Bench Press","4x8")
-        show_ex("Incline DB Press","3x10")
-        show_ex("Shoulder Press","3x12")
-        st.write("**Wed: Pull**")
-        show_ex("Barbell Row","4x8")
-        show_ex("Lat Pulldown","3x12")
-        show_ex("Seated Row","3x12")
-        st.write("**Fri: Legs**")
-        show_ex("Squat","4x8")
-        show_ex("Leg Press","4x12")
-        show_ex("Leg Curl","3x12")
-        show_ex("Calf Raise","3x15")
-        st.subheader(T("rest_cardio")); show_ex("Treadmill Incline","30–40 min"); show_ex("Side Plank","3x30s/side")
-
-    elif plan_type == "upper_lower":
-        st.write("**Mon & Thu: Upper**")
-        show_ex("Bench Press","4x8"); show_ex("Incline DB Press","3x10"); show_ex("Barbell Row","4x10"); show_ex("Shoulder Press","3x12")
-        st.write("**Tue & Fri: Lower**")
-        show_ex("Squat","4x8"); show_ex("Romanian Deadlift","3x10"); show_ex("Leg Press","4x12"); show_ex("Calf Raise","3x15")
-        st.subheader(T("rest_cardio")); show_ex("Treadmill Incline","30–40 min")
-
-    else:  # cardio_core
-        st.write("**Mon / Wed / Fri — Cardio & Core**")
-        show_ex("Treadmill Incline","40–50 min")
-        show_ex("Heavy Bag Boxing","5 x 2 min (1 min rest)")
-        show_ex("Plank","3 x max")
-        show_ex("Leg Raise","3x15")
-        st.subheader("**Tue / Thu — Strength (Light)**")
-        show_ex("Squat","3x8"); show_ex("Bench Press","3x8"); show_ex("Barbell Row","3x10")
+    # the whole plan is one cached markdown block: one delta per rerun
+    st.markdown(workout_block(profile["plan_type"], int(profile["training_days"]), st.session_state["lang"]))
 
 # ---------- PROGRESS TAB ----------
-with tabs[4]:
+@fragment
+@metrics.timed("section_seconds", section="progress")
+def progress_tab():
     st.subheader(T("progress_charts"))
     wcol1, wcol2 = st.columns([2,1])
     with wcol1:
         st.write(T("weight_entry"))
-        new_w = st.number_input(T("weight_kg"), min_value=30.0, max_value=300.0, value=float(weight_kg), step=0.1, key="neww")
+        new_w = st.number_input(T("weight_kg"), min_value=30.0, max_value=300.0, value=float(profile["weight_kg"]), step=0.1, key="neww")
     with wcol2:
         if st.button(T("add_weight")):
-            conn.execute("INSERT INTO weights(username, dt, weight) VALUES(?,?,?)", (user, date.today().isoformat(), float(new_w)))
-            conn.execute("UPDATE users SET weight_kg=? WHERE username=?", (float(new_w), user))
-            conn.commit()
+            queue_write("weights", [(db.WEIGHT_INSERT, (user, date.today().isoformat(), float(new_w))),
+                                    (db.USER_SET_WEIGHT, (float(new_w), user))],
+                        {"dt": date.today().isoformat(), "weight": float(new_w)})
+            profile["weight_kg"] = float(new_w)   # the memoized profile row sees its own write
             st.success("Saved")
-    wdf = pd.read_sql_query("SELECT dt, weight FROM weights WHERE username=?", conn, params=(user,))
-    if not wdf.empty:
-        wdf["dt"] = pd.to_datetime(wdf["dt"])
-        fig = px.line(wdf, x="dt", y="weight", markers=True, title="Weight Trend")
+    window = st.radio(T("date_range"), list(weight_history.WINDOWS), index=1, horizontal=True, key="weight_window",
+                      format_func=lambda w: T("all_time") if w == "all" else w)
+    start, end = weight_history.window_bounds(window)
+    wdf, waiting = read_your_writes("weights", (user, window, end),
+                                    lambda: weight_history.load(conn, user, start, end))
+    chart = memo("weight_chart", (user, window, end, data_version("weights"), len(waiting)),
+                 lambda: weight_history.chart_frame(pd.concat([wdf, pd.DataFrame(waiting)], ignore_index=True) if waiting else wdf, start))
+    if not chart.empty:
+        chart = chart.rename(columns={"avg7": T("trend_avg7"), "ema": T("trend_ema")})
+        with metrics.timer("plotly_seconds", chart="weight"):
+            fig = px.line(chart, x="dt", y=["weight", T("trend_avg7"), T("trend_ema")], title="Weight Trend")
+            fig.update_traces(mode="lines+markers", selector={"name": "weight"})
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("No weight data yet / Kilo kaydı yok")
+    nutrition_history_section()
+    data_io_section()
+
+def nutrition_history_section():
+    """Intake vs target and adherence, read only from the nutrition rollups."""
+    st.write(T("nutrition_history"))
+    window = st.radio(T("date_range"), list(weight_history.WINDOWS), index=1, horizontal=True, key="nutrition_window",
+                      format_func=lambda w: T("all_time") if w == "all" else w)
+    start, end = weight_history.window_bounds(window)
+    t = plan_targets()
+    fallback = {"workout": (t["wcal"], *t["macros_w"]), "rest": (t["rcal"], *t["macros_r"])}
+
+    def read():
+        nutrition_history.refresh(conn)
+        return nutrition_history.with_adherence(nutrition_history.load(conn, user, start, end), fallback)
+    hist = memo("nutrition_history", (user, window, end, data_version("food_logs"), fallback), read)
+    if hist.empty:
+        st.info(T("no_food_history"))
+        return
+    st.metric(T("adherence"), f"{hist['adherence'].mean():.0f}%")
+    chart = hist.rename(columns={"kcal": T("kcal"), "t_kcal": T("target")})
+    with metrics.timer("plotly_seconds", chart="nutrition"):
+        fig = px.line(chart, x="dt", y=[T("kcal"), T("target")], title=T("intake_vs_target"))
+        fig.update_traces(mode="lines+markers", selector={"name": T("kcal")})
+        afig = px.bar(hist, x="dt", y="adherence", range_y=[0, 100], title=T("adherence"))
+    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(afig, use_container_width=True)
+    # single days come from food_logs, or from the cold archive once they have been moved there
+    day = st.date_input(T("day_details"), value=end, max_value=end, key="nutrition_day")
+    rows = memo("nutrition_day", (user, day, data_version("food_logs")), lambda: archive.food_log(conn, user, day, day))
+    if not rows.empty:
+        st.dataframe(rows.drop(columns="dt"), hide_index=True, use_container_width=True)
+
+def data_io_section():
+    """Bulk import from other trackers / backups, and a chunked export of this user's rows."""
+    with st.expander(T("import_export")):
+        table = st.radio(T("import_export"), list(bulk_io.TABLES), key="io_table", horizontal=True,
+                         format_func=T, label_visibility="collapsed")
+        up = st.file_uploader(T("import_file"), type=["csv", "tsv", "gz", "parquet"], key="io_upload")
+        dayfirst = st.checkbox(T("import_dayfirst"), value=st.session_state["lang"] == "tr", key="io_dayfirst")
+        if up is not None and st.button(T("import"), key="io_import"):
+            rejects, status = [], st.empty()
+            try:
+                stats = bulk_io.import_file(conn, up, table, username=user, on_rejects=rejects.append,
+                                            progress=lambda s: status.caption(f"{s['read']:,} …"), dayfirst=dayfirst)
+            except bulk_io.READ_ERRORS as e:
+                st.error(str(e))
+            else:
+                touch(table)
+                status.success(f"{stats['written']:,} {T('rows_imported')}, {stats['rejected']:,} {T('rows_rejected')}")
+                if rejects:
+                    st.dataframe(pd.concat(rejects).head(200), hide_index=True)
+        fmt = st.radio(T("export"), ["csv", "parquet"], key="io_format", horizontal=True)
+        name = f"carioca_{user}_{table}." + ("csv.gz" if fmt == "csv" else fmt)
+        # built only when clicked, on Streamlit's download thread (hence its own connection);
+        # nothing is kept in session_state between reruns
+        st.download_button(f"{T('download')} {name}", lambda: export_bytes(table, fmt, user, name),
+                           file_name=name, key="io_download", on_click="ignore")
+
+def export_bytes(table: str, fmt: str, username: str, name: str) -> bytes:
+    export_conn = get_db().connect()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, name)
+            bulk_io.export_file(export_conn, path, table, fmt, username=username)
+            with open(path, "rb") as f:
+                return f.read()
+    finally:
+        export_conn.close()
+
+# ---------- Sections ----------
+# Only the selected section runs on a rerun; st.tabs would execute all five every time.
+SECTIONS = {"profile": profile_tab, "deficit_calc": deficit_tab, "nutrition": nutrition_tab,
+            "workout": workout_tab, "progress": progress_tab}
+active = st.radio("section", list(SECTIONS), key="active_tab", horizontal=True,
+                  format_func=T, label_visibility="collapsed")
+SECTIONS[active]()
+
+# ---------- Debug panel ----------
+# Drawn after the section so a full rerun shows its own timings.
+def debug_panel():
+    snap = metrics.snapshot()
+    with st.sidebar.expander("Debug · metrics"):
+        rows = [{"metric": h["name"], "labels": ", ".join(f"{k}={v}" for k, v in h["labels"].items()), "n": h["count"],
+                 "p50 ms": round(h["p50"]*1000, 2), "p95 ms": round(h["p95"]*1000, 2), "p99 ms": round(h["p99"]*1000, 2),
+                 "total s": round(h["sum"], 3)} for h in snap["histograms"]]
+        if rows:
+            st.dataframe(pd.DataFrame(rows).sort_values("total s", ascending=False), hide_index=True)
+        recent = sorted(list(metrics.recent_sql), key=lambda r: -r[2])[:10]
+        if recent:
+            st.caption("Slowest recent SQL")
+            st.dataframe(pd.DataFrame([(s, round(ms, 2), n) for _, s, ms, n in recent], columns=["statement", "ms", "rows"]),
+                         hide_index=True)
+        st.caption("Write queue")
+        st.dataframe(pd.DataFrame([get_writer().stats()]), hide_index=True)
+        st.caption("OFF cache")
+        st.dataframe(pd.DataFrame([get_off_cache().stats()]), hide_index=True)
+        st.download_button("carioca.prom", metrics.prometheus_text(snap), file_name="carioca.prom", mime="text/plain")
+
+if metrics.ENABLED and user in metrics.ADMINS:
+    debug_panel()
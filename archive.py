@@ -0,0 +1,193 @@
+"""Cold storage for old `food_logs` rows: per-user Arrow IPC files listed in the
+`food_log_archive` manifest, so the live table holds only recent rows while the full
+history stays readable.
+
+    python archive.py run                           # rows older than CARIOCA_ARCHIVE_AFTER_DAYS
+    python archive.py run --older-than 180 --vacuum
+    python archive.py ls --user ana
+
+Each user's old rows are copied to a file from a read snapshot, then re-checked and removed
+from SQLite in a short IMMEDIATE transaction; the daily / weekly nutrition rollups keep
+them. Reads memory-map the files.
+Columns of uncompressed files (CARIOCA_ARCHIVE_COMPRESSION=none) point straight into the
+mapping; compressed ones (zstd by default) are decompressed once per read. Needs pyarrow.
+"""
+import argparse, hashlib, math, os, sys, time
+from datetime import date, timedelta
+import pandas as pd
+import db, nutrition_history
+
+ARCHIVE_DIR = os.environ.get("CARIOCA_ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.environ.get("CARIOCA_ARCHIVE_AFTER_DAYS", 365))
+COMPRESSION = os.environ.get("CARIOCA_ARCHIVE_COMPRESSION", "zstd")    # zstd, lz4 or none
+CHUNK_ROWS = 100_000
+COLS = ["id", "dt", "food_name", "grams", "kcal", "protein", "carbs", "fat"]
+OLD_ROWS = f"SELECT {', '.join(COLS)} FROM food_logs WHERE username=? AND dt < ? ORDER BY dt, id"
+# what the delete re-checks against the copy: row count and the sum of every numeric column
+COPIED_ROWS = ("SELECT COUNT(*), TOTAL(COALESCE(grams, 0) + COALESCE(kcal, 0) + COALESCE(protein, 0)"
+               " + COALESCE(carbs, 0) + COALESCE(fat, 0)) FROM food_logs WHERE username=? AND dt < ? AND id <= ?")
+COPY_ATTEMPTS = 3
+
+def _pyarrow():
+    try:
+        import pyarrow as pa, pyarrow.ipc as ipc
+    except ImportError:
+        raise SystemExit("The food log archive needs pyarrow: pip install pyarrow") from None
+    return pa, ipc
+
+def _schema(pa):
+    return pa.schema([("id", pa.int64()), ("dt", pa.string()), ("food_name", pa.string())]
+                     + [(c, pa.float64()) for c in COLS[3:]])
+
+def user_dir(username: str) -> str:
+    # usernames are free text; their directory is a stable hash
+    return hashlib.sha256(username.encode()).hexdigest()[:16]
+
+# ---------- Archiving ----------
+def _copy(conn, username: str, cutoff: str, root: str):
+    """Write `username`'s rows dated before `cutoff` to a new file from one read snapshot;
+    writers carry on meanwhile (WAL). Returns (manifest row, checksum), or (None, None)."""
+    pa, ipc = _pyarrow()
+    schema = _schema(pa)
+    d = os.path.join(root, user_dir(username))
+    os.makedirs(d, exist_ok=True)
+    tmp = os.path.join(d, f".tmp-{os.getpid()}.arrow")
+    opts = ipc.IpcWriteOptions(compression=None if COMPRESSION == "none" else COMPRESSION)
+    n, max_id, dt_min, dt_max, checksum = 0, 0, None, None, 0.0
+    try:
+        with conn:
+            conn.execute("BEGIN")       # one snapshot for the whole copy
+            with pa.OSFile(tmp, "wb") as sink, ipc.new_file(sink, schema, options=opts) as w:
+                cur = conn.execute(OLD_ROWS, (username, cutoff))
+                while rows := cur.fetchmany(CHUNK_ROWS):
+                    cols = list(zip(*rows))
+                    w.write_batch(pa.record_batch([pa.array(c, f.type) for c, f in zip(cols, schema)], schema=schema))
+                    n, max_id = n + len(rows), max(max_id, max(cols[0]))
+                    dt_min, dt_max = dt_min or rows[0][1], rows[-1][1]
+                    checksum += sum(v for c in cols[3:] for v in c if v is not None)
+        if not n:
+            os.remove(tmp)
+            return None, None
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        path = os.path.join(user_dir(username), f"food_logs_{dt_min}_{dt_max}_{max_id}.arrow")
+        os.replace(tmp, os.path.join(root, path))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return {"username": username, "path": path, "dt_min": dt_min, "dt_max": dt_max, "max_id": max_id,
+            "rows": n, "bytes": os.path.getsize(os.path.join(root, path))}, checksum
+
+def archive_user(conn, username: str, cutoff: str, root: str = ARCHIVE_DIR) -> dict:
+    """Move `username`'s rows dated before `cutoff` into one new file; returns its manifest
+    row, or None if there was nothing to move (or the rows kept changing under the copy).
+    The write lock is held only to re-check the copied rows, delete them and add the
+    manifest row, not while the file is encoded and synced."""
+    for _ in range(COPY_ATTEMPTS):
+        row, checksum = _copy(conn, username, cutoff, root)
+        if row is None:
+            return None
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            n, total = conn.execute(COPIED_ROWS, (username, cutoff, row["max_id"])).fetchone()
+            if n == row["rows"] and math.isclose(total, checksum, rel_tol=1e-9, abs_tol=1e-6):
+                row["created_at"] = pd.Timestamp.now("UTC").isoformat()
+                conn.execute("INSERT INTO food_log_archive(username, path, dt_min, dt_max, max_id, rows, bytes, created_at)"
+                             " VALUES(:username, :path, :dt_min, :dt_max, :max_id, :rows, :bytes, :created_at)", row)
+                conn.execute("UPDATE rollup_state SET archiving = 1")      # rollups keep archived rows
+                conn.execute("DELETE FROM food_logs WHERE username=? AND dt < ? AND id <= ?", (username, cutoff, row["max_id"]))
+                conn.execute("UPDATE rollup_state SET archiving = 0")
+                return row
+        os.remove(os.path.join(root, row["path"]))      # old rows were edited meanwhile: copy again
+    return None
+
+def archive_all(conn, older_than_days: int = ARCHIVE_AFTER_DAYS, today: date = None,
+                root: str = ARCHIVE_DIR, progress=None) -> list:
+    """Archive every user's rows older than `older_than_days`; returns the manifest rows added."""
+    cutoff = ((today or date.today()) - timedelta(days=older_than_days)).isoformat()
+    nutrition_history.refresh(conn)     # rows must be in the rollups before they leave food_logs
+    users = [r[0] for r in conn.execute("SELECT DISTINCT username FROM food_logs WHERE dt < ?", (cutoff,))]
+    out = []
+    for u in users:
+        row = archive_user(conn, u, cutoff, root)
+        if row:
+            out.append(row)
+            if progress:
+                progress(row)
+    return out
+
+# ---------- Reading ----------
+def _open(root: str, path: str):
+    pa, ipc = _pyarrow()
+    # the mapping stays alive as long as any column built on it does
+    return ipc.open_file(pa.memory_map(os.path.join(root, path)))
+
+def read_table(conn, username: str, start: str, end: str, root: str = ARCHIVE_DIR):
+    """Archived rows of `username` with start <= dt <= end as one Arrow table, or None."""
+    files = conn.execute(db.ARCHIVE_FILES, (username, start, end)).fetchall()
+    if not files:
+        return None
+    pa, _ = _pyarrow()
+    import pyarrow.compute as pc
+    tables = []
+    for path, dt_min, dt_max, _ in files:
+        t = _open(root, path).read_all()
+        if dt_min < start or dt_max > end:
+            t = t.filter(pc.and_(pc.greater_equal(t["dt"], start), pc.less_equal(t["dt"], end)))
+        tables.append(t)
+    return pa.concat_tables(tables)
+
+def food_log(conn, username: str, start, end, root: str = ARCHIVE_DIR) -> pd.DataFrame:
+    """Food log rows in [start, end] from the archive and the live table, in date order."""
+    start, end = str(start), str(end)
+    live = pd.read_sql_query(db.FOOD_LOG_RANGE, conn, params=(username, start, end))
+    cold = read_table(conn, username, start, end, root)
+    if cold is None or cold.num_rows == 0:
+        return live
+    cold = cold.drop_columns(["id"]).to_pandas()
+    return pd.concat([cold, live], ignore_index=True).sort_values("dt", kind="stable", ignore_index=True)
+
+def export_chunks(conn, username: str = None, root: str = ARCHIVE_DIR):
+    """Archived rows as DataFrames in bulk_io's food_logs column order, one record batch each."""
+    if username is None:
+        files = conn.execute("SELECT username, path FROM food_log_archive ORDER BY username, dt_min").fetchall()
+    else:
+        files = [(username, r[0]) for r in conn.execute(db.ARCHIVE_FILES, (username, "0000-00-00", "9999-99-99"))]
+    for u, path in files:
+        reader = _open(root, path)
+        for i in range(reader.num_record_batches):
+            df = reader.get_batch(i).to_pandas().drop(columns="id")
+            df.insert(0, "username", u)
+            yield df
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Carioca food log archive")
+    ap.add_argument("cmd", choices=["run", "ls"])
+    ap.add_argument("--older-than", type=int, default=ARCHIVE_AFTER_DAYS, help="days (default %(default)s)")
+    ap.add_argument("--vacuum", action="store_true", help="run: shrink the database file afterwards")
+    ap.add_argument("--user", help="ls: only this user")
+    ap.add_argument("--dir", default=ARCHIVE_DIR)
+    ap.add_argument("--db", default=db.DB_PATH)
+    args = ap.parse_args(argv)
+    db.Database(args.db)
+    conn = db.connect(args.db)
+    if args.cmd == "ls":
+        sql = "SELECT username, path, dt_min, dt_max, rows, bytes FROM food_log_archive"
+        rows = conn.execute(sql + (" WHERE username=?" if args.user else "") + " ORDER BY username, dt_min",
+                            (args.user,) if args.user else ()).fetchall()
+        for u, path, lo, hi, n, size in rows:
+            print(f"{u}\t{lo}..{hi}\t{n:,} rows\t{size / 2**20:.1f} MB\t{path}")
+        return
+    t0 = time.perf_counter()
+    added = archive_all(conn, args.older_than, root=args.dir,
+                        progress=lambda r: print(f"{r['username']}: {r['rows']:,} rows -> {r['path']}", file=sys.stderr))
+    n = sum(r["rows"] for r in added)
+    print(f"archived {n:,} rows for {len(added)} users in {time.perf_counter()-t0:.2f}s", file=sys.stderr)
+    if args.vacuum and added:
+        conn.execute("VACUUM")
+        print(f"vacuumed in {time.perf_counter()-t0:.2f}s total", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Password hashing off the script thread, login rate limiting and signed session tokens.
+
+bcrypt runs on a small worker pool so a burst of logins uses at most AUTH_WORKERS cores
+instead of stalling every session's reruns; work beyond MAX_PENDING is refused rather
+than queued. The pool is threads, not processes: bcrypt releases the GIL while hashing,
+and process workers would re-execute the app script, which Streamlit runs as __main__.
+
+A successful login yields an HMAC-signed, expiring token, kept in a SameSite cookie (never
+the URL), that lets a reconnecting client resume without running bcrypt again. Tokens carry
+the user's `token_gen`; logout bumps it, which revokes every token issued before.
+"""
+import base64, hashlib, hmac, json, os, secrets, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+import metrics
+
+BCRYPT_ROUNDS = int(os.environ.get("CARIOCA_BCRYPT_ROUNDS", 12))
+AUTH_WORKERS = int(os.environ.get("CARIOCA_AUTH_WORKERS", min(4, os.cpu_count() or 1)))
+MAX_PENDING = AUTH_WORKERS * 4
+AUTH_TIMEOUT = 15.0
+SECRET_PATH = os.environ.get("CARIOCA_SECRET_FILE", "carioca_secret.key")
+SESSION_TTL = int(os.environ.get("CARIOCA_SESSION_TTL", 7 * 24 * 3600))
+SESSION_COOKIE = "carioca_session"
+# (attempts, seconds) per username and per client address
+USER_LIMIT = (5, 300)
+IP_LIMIT = (30, 300)
+REGISTER_LIMIT = (5, 3600)     # per client address; every registration runs bcrypt
+# reverse proxies in front of the app that append to X-Forwarded-For; 0 trusts no header
+TRUSTED_PROXY_HOPS = int(os.environ.get("CARIOCA_TRUSTED_PROXY_HOPS", 0))
+
+class Busy(Exception):
+    """The hashing pool is saturated; the caller should ask the user to retry."""
+
+# ---------- bcrypt pool ----------
+def _hash(pw: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(pw, bcrypt.gensalt(rounds))
+
+def _check(pw: bytes, pw_hash: bytes) -> bool:
+    try:
+        return bcrypt.checkpw(pw, pw_hash)
+    except ValueError:
+        return False
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+
+def pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(AUTH_WORKERS, thread_name_prefix="carioca-bcrypt")
+        return _pool
+
+def _run(op: str, fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise Busy()
+    try:
+        with metrics.timer("bcrypt_seconds", op=op):
+            return pool().submit(fn, *args).result(timeout=AUTH_TIMEOUT)
+    except FutureTimeout:
+        raise Busy() from None
+    finally:
+        _slots.release()
+
+def rounds_of(pw_hash: bytes) -> int:
+    """Cost factor stored in a `$2b$12$...` hash (0 if unparseable)."""
+    try:
+        return int(pw_hash.split(b"$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+def hash_password(pw: str, rounds: int = None) -> bytes:
+    return _run("hash", _hash, pw.encode(), rounds or BCRYPT_ROUNDS)
+
+def verify(pw: str, pw_hash: bytes):
+    """(ok, needs_rehash): rehash when the stored cost differs from BCRYPT_ROUNDS."""
+    if isinstance(pw_hash, str):
+        pw_hash = pw_hash.encode()
+    ok = _run("check", _check, pw.encode(), pw_hash)
+    return ok, ok and rounds_of(pw_hash) != BCRYPT_ROUNDS
+
+# ---------- Rate limiting ----------
+class RateLimiter:
+    """Sliding-window attempt counter per key."""
+    def __init__(self, attempts: int, window: float):
+        self.attempts, self.window = attempts, window
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def retry_after(self, key) -> float:
+        """Seconds until `key` may try again; 0 if allowed now."""
+        now = time.monotonic()
+        with self._lock:
+            q = self._hits.get(key)
+            while q and q[0] <= now - self.window:
+                q.popleft()
+            if not q:
+                self._hits.pop(key, None)
+                return 0.0
+            return 0.0 if len(q) < self.attempts else q[0] + self.window - now
+
+    def hit(self, key):
+        with self._lock:
+            if len(self._hits) > 10_000:
+                cutoff = time.monotonic() - self.window
+                self._hits = {k: q for k, q in self._hits.items() if q and q[-1] > cutoff}
+            self._hits.setdefault(key, deque()).append(time.monotonic())
+
+    def clear(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+user_limiter = RateLimiter(*USER_LIMIT)
+ip_limiter = RateLimiter(*IP_LIMIT)
+register_limiter = RateLimiter(*REGISTER_LIMIT)
+
+def forwarded_ip(header: str, hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """The client address recorded by the outermost of `hops` trusted proxies: counted from
+    the right of X-Forwarded-For, since anything further left was sent by the client."""
+    parts = [p.strip() for p in (header or "").split(",") if p.strip()]
+    return parts[-hops] if hops and len(parts) >= hops else None
+
+def login_wait(username: str, ip: str) -> float:
+    return max(user_limiter.retry_after(username), ip_limiter.retry_after(ip) if ip else 0.0)
+
+def register_wait(ip: str) -> float:
+    """Seconds until `ip` may register again; 0 counts this attempt. Clients without a
+    known address share one budget."""
+    wait = register_limiter.retry_after(ip or "")
+    if not wait:
+        register_limiter.hit(ip or "")
+    return wait
+
+def record_attempt(username: str, ip: str, ok: bool):
+    if ip:
+        ip_limiter.hit(ip)
+    if ok:
+        user_limiter.clear(username)
+    else:
+        user_limiter.hit(username)
+
+# ---------- Session tokens ----------
+_secret = None
+
+def secret() -> bytes:
+    """Signing key from CARIOCA_SECRET, else a key file created on first use."""
+    global _secret
+    if _secret is None:
+        env = os.environ.get("CARIOCA_SECRET")
+        if env:
+            _secret = env.encode()
+        else:
+            try:
+                with open(SECRET_PATH, "rb") as f:
+                    _secret = f.read()
+            except FileNotFoundError:
+                _secret = _create_secret()
+    return _secret
+
+def _create_secret() -> bytes:
+    key = secrets.token_bytes(32)
+    try:
+        fd = os.open(SECRET_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:          # another process won the race
+        with open(SECRET_PATH, "rb") as f:
+            return f.read()
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+def _b64(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode()
+
+def _unb64(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+def _pw_tag(pw_hash: bytes) -> str:
+    """Ties a token to the current password hash: changing the password revokes it."""
+    if isinstance(pw_hash, str):
+        pw_hash = pw_hash.encode()
+    return _b64(hashlib.sha256(pw_hash).digest()[:8])
+
+def issue_token(username: str, pw_hash: bytes, gen: int, ttl: int = SESSION_TTL) -> str:
+    body = _b64(json.dumps({"u": username, "exp": int(time.time()) + ttl, "pw": _pw_tag(pw_hash), "g": gen},
+                           separators=(",", ":")).encode())
+    return body + "." + _b64(hmac.new(secret(), body.encode(), hashlib.sha256).digest())
+
+def token_user(token: str, lookup) -> str:
+    """Username for a valid, unexpired, unrevoked token, else None. `lookup(username)`
+    returns the stored (pw_hash, token_gen), or None."""
+    try:
+        body, sig = token.split(".")
+        if not hmac.compare_digest(_unb64(sig), hmac.new(secret(), body.encode(), hashlib.sha256).digest()):
+            return None
+        claims = json.loads(_unb64(body))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+        return None
+    stored = lookup(claims.get("u"))
+    if stored is None or claims.get("g") != stored[1]:
+        return None
+    if not hmac.compare_digest(_pw_tag(stored[0]), str(claims.get("pw", ""))):
+        return None
+    return claims["u"]
+
+def cookie_script(token: str, secure: bool, ttl: int = SESSION_TTL) -> str:
+    """<script> that stores `token` in the session cookie, or deletes the cookie for ""."""
+    attrs = f"path=/; max-age={ttl if token else 0}; SameSite=Strict" + ("; Secure" if secure else "")
+    return f"<script>document.cookie = {json.dumps(f'{SESSION_COOKIE}={token}; {attrs}')};</script>"
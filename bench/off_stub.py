@@ -0,0 +1,83 @@
+"""Local stand-in for the OpenFoodFacts search endpoint with injectable latency and failures.
+
+    python bench/off_stub.py --port 8765 --latency-ms 150 --jitter-ms 50 --fail-rate 0.05
+then point the app at it with CARIOCA_OFF_URL=http://127.0.0.1:8765/cgi/search.pl
+"""
+import argparse, hashlib, json, random, threading, time, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def products(query: str, page_size: int) -> list:
+    """Deterministic fake products for a query: same terms, same rows."""
+    rng = random.Random(hashlib.sha1(query.encode()).digest())
+    out = []
+    for i in range(page_size):
+        p, c, f = rng.uniform(0, 35), rng.uniform(0, 80), rng.uniform(0, 40)
+        out.append({"product_name": f"{query.title()} {i+1}", "product_name_tr": f"{query.title()} TR {i+1}",
+                    "brands": rng.choice(["Acme", "Tropic", "Carioca Farms", ""]),
+                    "nutriments": {"energy-kcal_100g": round(p*4 + c*4 + f*9, 1), "proteins_100g": round(p, 1),
+                                   "carbohydrates_100g": round(c, 1), "fat_100g": round(f, 1)}})
+    return out
+
+class StubConfig:
+    def __init__(self, latency_ms=100.0, jitter_ms=0.0, fail_rate=0.0, hang_rate=0.0, hang_s=30.0, seed=0):
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.fail_rate, self.hang_rate, self.hang_s = fail_rate, hang_rate, hang_s
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+def make_handler(cfg: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"      # keep-alive, like the real API
+
+        def do_GET(self):
+            with cfg.lock:
+                cfg.requests += 1
+                roll, delay = cfg.rng.random(), max(0.0, cfg.rng.gauss(cfg.latency_ms, cfg.jitter_ms)) / 1000
+            if roll < cfg.hang_rate:
+                time.sleep(cfg.hang_s)       # longer than the client timeout
+            time.sleep(delay)
+            if roll >= cfg.hang_rate and roll < cfg.hang_rate + cfg.fail_rate:
+                return self._send(503, b'{"error": "stub failure"}')
+            qs = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            query = qs.get("search_terms", [""])[0]
+            size = int(qs.get("page_size", ["20"])[0])
+            self._send(200, json.dumps({"products": products(query, size)}).encode())
+
+        def _send(self, status, body):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+def start(port: int = 0, **config):
+    """Serve in a daemon thread; returns (server, config, base_url)."""
+    cfg = StubConfig(**config)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(cfg))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="off-stub", daemon=True).start()
+    return server, cfg, f"http://127.0.0.1:{server.server_address[1]}/cgi/search.pl"
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="OpenFoodFacts stub server")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=100.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--hang-rate", type=float, default=0.0)
+    args = ap.parse_args(argv)
+    server, _, url = start(args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                           fail_rate=args.fail_rate, hang_rate=args.hang_rate)
+    print(f"serving {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Headless benchmark: drives app.py through Streamlit's AppTest against a seeded database
+and a local OpenFoodFacts stub, and reports per-scenario rerun latency, SQL time and memory.
+
+    python bench/run.py --users 50 --years 3 --food-rows 1000000 --iterations 30
+    python bench/run.py --db bench.db --no-seed --out new.json --baseline old.json
+
+Results are written as JSON (--out). With --baseline, scenarios whose p95 regressed by more
+than --tolerance are listed and the exit status is 1.
+"""
+import argparse, json, os, platform, resource, subprocess, sys, tempfile, threading, time, tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["login", "profile_save", "food_search", "add_food", "generate_menu", "progress_chart"]
+
+# ---------- SQL timing ----------
+class SqlClock:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.seconds, self.statements = 0.0, 0
+
+    def add(self, dt, statements=0):
+        with self.lock:
+            self.seconds += dt
+            self.statements += statements
+
+SQL = SqlClock()
+
+def timed_factories():
+    import sqlite3
+
+    def timed(method, statements):
+        def wrapper(self, *args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                SQL.add(time.perf_counter() - t, statements)
+        return wrapper
+
+    class TimedCursor(sqlite3.Cursor):
+        execute = timed(sqlite3.Cursor.execute, 1)
+        executemany = timed(sqlite3.Cursor.executemany, 1)
+        fetchone = timed(sqlite3.Cursor.fetchone, 0)
+        fetchmany = timed(sqlite3.Cursor.fetchmany, 0)
+        fetchall = timed(sqlite3.Cursor.fetchall, 0)
+
+    class TimedConnection(sqlite3.Connection):
+        def cursor(self, factory=TimedCursor):
+            return super().cursor(factory)
+
+        def execute(self, *args):
+            return self.cursor().execute(*args)
+
+        def executemany(self, *args):
+            return self.cursor().executemany(*args)
+
+        commit = timed(sqlite3.Connection.commit, 0)
+
+    return TimedConnection
+
+# ---------- Driving the app ----------
+class Bench:
+    def __init__(self, app_path, users, timeout):
+        from streamlit import logger
+        from streamlit.testing.v1 import AppTest
+        logger.set_log_level("error")     # bare-mode warnings would drown the report
+        self.AppTest, self.app_path, self.users, self.timeout = AppTest, app_path, users, timeout
+        self.n = 0
+
+    def fresh(self):
+        return self.AppTest.from_file(self.app_path, default_timeout=self.timeout).run()
+
+    @staticmethod
+    def button(at, label):
+        return next(b for b in at.button if b.label == label)
+
+    def next_user(self):
+        self.n += 1
+        return f"bench_{self.n % self.users}"
+
+    def login(self, at=None):
+        import seed
+        at = at or self.fresh()
+        at.text_input[0].input(self.next_user())
+        at.text_input[1].input(seed.PASSWORD)
+        return self.button(at, "Log In").click()
+
+    def logged_in(self, section=None):
+        at = self.login().run()
+        self.check(at)
+        if section:
+            at.radio(key="active_tab").set_value(section).run()
+        return at
+
+    @staticmethod
+    def check(at):
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+def measure(action, at_of):
+    """Time one rerun; returns a sample dict."""
+    tracemalloc.reset_peak()
+    SQL.reset()
+    t = time.perf_counter()
+    at = action()
+    wall = time.perf_counter() - t
+    Bench.check(at_of(at))
+    return {"wall": wall, "sql": SQL.seconds, "statements": SQL.statements,
+            "peak_bytes": tracemalloc.get_traced_memory()[1]}
+
+def run_scenario(b: Bench, name: str, iterations: int) -> list:
+    samples = []
+    if name == "login":
+        for _ in range(iterations):
+            at = b.fresh()
+            samples.append(measure(lambda: b.login(at).run(), lambda r: r))
+    elif name == "profile_save":
+        at = b.logged_in("profile")
+        for _ in range(iterations):
+            samples.append(measure(lambda: b.button(at, "Save").click().run(), lambda r: r))
+    elif name == "food_search":
+        at = b.logged_in("nutrition")
+        box = lambda: next(t for t in at.text_input if t.label.startswith("Search food"))
+        for i in range(iterations):
+            samples.append(measure(lambda: box().input(f"bench food {i}").run(), lambda r: r))
+    elif name == "add_food":
+        at = b.logged_in("nutrition")
+        next(t for t in at.text_input if t.label.startswith("Search food")).input("chicken").run()
+        for _ in range(iterations):
+            samples.append(measure(lambda: b.button(at, "Add").click().run(), lambda r: r))
+    elif name == "generate_menu":
+        at = b.logged_in("nutrition")
+        for _ in range(iterations):
+            samples.append(measure(lambda: b.button(at, "Generate Menu").click().run(), lambda r: r))
+    elif name == "progress_chart":
+        at = b.logged_in("progress")
+        for i in range(iterations):
+            window = "all" if i % 2 == 0 else "1y"
+            samples.append(measure(lambda: at.radio(key="weight_window").set_value(window).run(), lambda r: r))
+    return samples
+
+def summarize(samples: list) -> dict:
+    import numpy as np
+    wall = np.array([s["wall"] for s in samples]) * 1000
+    sql = np.array([s["sql"] for s in samples]) * 1000
+    pct = lambda a, p: round(float(np.percentile(a, p)), 2)
+    return {"n": len(samples), "mean_ms": round(float(wall.mean()), 2),
+            "p50_ms": pct(wall, 50), "p95_ms": pct(wall, 95), "p99_ms": pct(wall, 99),
+            "sql_p50_ms": pct(sql, 50), "sql_p95_ms": pct(sql, 95),
+            "sql_statements_mean": round(float(np.mean([s["statements"] for s in samples])), 1),
+            "peak_mem_mb": round(max(s["peak_bytes"] for s in samples) / 2**20, 1)}
+
+def compare(current: dict, baseline: dict, tolerance: float, floor_ms: float = 5.0) -> list:
+    """Scenarios whose p95 grew by more than `tolerance` (and by more than `floor_ms`)."""
+    out = []
+    for name, cur in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old and cur["p95_ms"] > old["p95_ms"] * (1 + tolerance) and cur["p95_ms"] - old["p95_ms"] > floor_ms:
+            out.append(f"{name}: p95 {old['p95_ms']} -> {cur['p95_ms']} ms")
+    return out
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Carioca headless benchmark")
+    ap.add_argument("--db", help="database to use (default: a fresh temp file)")
+    ap.add_argument("--no-seed", action="store_true", help="use --db as is")
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--years", type=float, default=2)
+    ap.add_argument("--food-rows", type=int, default=200_000)
+    ap.add_argument("--iterations", type=int, default=20)
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--off-latency-ms", type=float, default=120)
+    ap.add_argument("--off-jitter-ms", type=float, default=40)
+    ap.add_argument("--off-fail-rate", type=float, default=0.0)
+    ap.add_argument("--off-hang-rate", type=float, default=0.0)
+    ap.add_argument("--food-index", help="local OFF index to search first (default: none)")
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--baseline")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="carioca-bench-")
+    db_path = os.path.abspath(args.db or os.path.join(tmp, "bench.db"))
+    sys.path[:0] = [ROOT, os.path.join(ROOT, "bench")]
+    import off_stub
+    stub, stub_cfg, stub_url = off_stub.start(latency_ms=args.off_latency_ms, jitter_ms=args.off_jitter_ms,
+                                              fail_rate=args.off_fail_rate, hang_rate=args.off_hang_rate)
+    # the app's modules read these at import time, so set them before anything imports db
+    os.environ.update({"CARIOCA_DB": db_path, "CARIOCA_OFF_URL": stub_url,
+                       "CARIOCA_OFF_CACHE": os.path.join(tmp, "off_cache.db"),
+                       "CARIOCA_FOOD_INDEX": os.path.abspath(args.food_index) if args.food_index else os.path.join(tmp, "none.db")})
+    import db, seed
+    db.CONNECTION_FACTORY = timed_factories()
+    if not args.no_seed:
+        seed.seed(db_path, args.users, args.years, args.food_rows, log=lambda *a, **k: print(*a, file=sys.stderr, **k))
+
+    os.chdir(ROOT)    # app.py opens its language files relative to the working directory
+    b = Bench(os.path.join(ROOT, "app.py"), args.users, args.timeout)
+    tracemalloc.start()
+    results = {}
+    for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        t0 = time.perf_counter()
+        results[name] = summarize(run_scenario(b, name, args.iterations))
+        print(f"{name:16s} p50 {results[name]['p50_ms']:8.1f} ms  p95 {results[name]['p95_ms']:8.1f} ms  "
+              f"p99 {results[name]['p99_ms']:8.1f} ms  sql p50 {results[name]['sql_p50_ms']:7.1f} ms  "
+              f"({time.perf_counter()-t0:.1f}s)", file=sys.stderr)
+    tracemalloc.stop()
+    stub.shutdown()
+
+    report = {"meta": {"timestamp": datetime.now(timezone.utc).isoformat(), "git_rev": git_rev(),
+                       "python": platform.python_version(), "platform": platform.platform(),
+                       "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                       "off_requests": stub_cfg.requests, "params": vars(args)},
+              "scenarios": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Synthetic data for benchmarks: users, daily weigh-ins and food logs in carioca_v2.db.
+
+    python bench/seed.py --db bench.db --users 200 --years 3 --food-rows 2000000
+Every seeded user is `bench_<n>` with password `bench`.
+"""
+import argparse, os, sys, time
+from datetime import date, timedelta
+import bcrypt
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db, nutrition_history
+
+PASSWORD = "bench"
+FOODS = [("Chicken breast", 165, 31, 0, 3.6), ("Rice", 130, 2.7, 28, 0.3), ("Oats", 389, 17, 66, 7),
+         ("Egg", 155, 13, 1.1, 11), ("Yogurt", 61, 3.5, 4.7, 3.3), ("Almonds", 579, 21, 22, 50),
+         ("Banana", 89, 1.1, 23, 0.3), ("Broccoli", 34, 2.8, 7, 0.4), ("Olive oil", 884, 0, 0, 100)]
+CHUNK = 200_000
+
+def username(i: int) -> str:
+    return f"bench_{i}"
+
+def seed(path: str, users: int, years: float, food_rows: int, seed: int = 0, log=print) -> dict:
+    rng = np.random.default_rng(seed)
+    db.Database(path)
+    conn = db.connect(path)
+    end = date.today()
+    days = max(1, int(years * 365))
+    start = end - timedelta(days=days - 1)
+    pw_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt())   # one hash shared by every bench user
+    t0 = time.perf_counter()
+    with conn:
+        conn.executemany("""INSERT OR REPLACE INTO users(username, pw_hash, lang, age, sex, height_cm, weight_kg, bodyfat,
+                            activity, target_weight, training_days, created_at) VALUES(?,?,?,?,?,?,?,?,?,?,?,?)""",
+                         [(username(i), pw_hash, "en", int(rng.integers(18, 70)), "male" if i % 2 else "female",
+                           float(rng.integers(150, 200)), float(rng.uniform(55, 120)), float(rng.uniform(12, 35)),
+                           ["sedentary", "light", "moderate", "high", "very_high"][i % 5],
+                           float(rng.uniform(55, 100)), int(rng.integers(2, 7)), start.isoformat())
+                          for i in range(users)])
+    # one weigh-in per user per day: a random walk around the profile weight
+    dates = np.array([(start + timedelta(days=d)).isoformat() for d in range(days)])
+    for i in range(users):
+        walk = 80 + np.cumsum(rng.normal(-0.01, 0.25, days))
+        with conn:
+            conn.executemany(db.WEIGHT_INSERT, zip([username(i)] * days, dates.tolist(), walk.round(1).tolist()))
+    foods = np.array(FOODS, dtype=object)
+    written = 0
+    while written < food_rows:
+        n = min(CHUNK, food_rows - written)
+        u = rng.integers(0, users, n)
+        d = rng.integers(0, days, n)
+        f = rng.integers(0, len(FOODS), n)
+        g = rng.integers(20, 400, n).astype(float)
+        per100 = np.array([r[1:] for r in FOODS], float)[f] * (g / 100.0)[:, None]
+        rows = zip((username(x) for x in u.tolist()), dates[d].tolist(), foods[f, 0].tolist(), g.tolist(),
+                   *(per100[:, k].round(1).tolist() for k in range(4)))
+        with conn, nutrition_history.folding(conn):
+            conn.executemany(db.FOOD_LOG_INSERT, rows)
+        written += n
+        log(f"\rfood_logs {written:,}/{food_rows:,}", end="")
+    conn.execute("ANALYZE")
+    log(f"\nseeded {users} users, {users*days:,} weights, {food_rows:,} food logs in {time.perf_counter()-t0:.1f}s")
+    return {"users": users, "weights": users * days, "food_logs": food_rows, "start": start.isoformat()}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Seed a Carioca database with synthetic data")
+    ap.add_argument("--db", default="bench.db")
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--years", type=float, default=3)
+    ap.add_argument("--food-rows", type=int, default=1_000_000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+    seed(args.db, args.users, args.years, args.food_rows, args.seed,
+         log=lambda *a, **k: print(*a, file=sys.stderr, **k))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Bulk import / export of `food_logs` and `weights` as CSV or Parquet, in fixed-size chunks
+so memory stays flat whatever the file size.
+
+    python bulk_io.py import food_logs mfp_export.csv --user ana --rejects bad_rows.csv
+    python bulk_io.py import weights backup.parquet                 # file has a username column
+    python bulk_io.py import weights scale.csv --user ana --dayfirst  # 31/12/2024-style dates
+    python bulk_io.py export food_logs ana_food.parquet --user ana
+
+Each chunk is normalized with vectorized pandas (column aliases, ISO dates, numeric ranges),
+invalid rows are set aside with a reason, and the rest go in with one `executemany` per
+chunk inside its own transaction. Parquet needs pyarrow.
+"""
+import argparse, contextlib, gzip, re, sys, time, warnings, zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import archive, db, nutrition_history
+
+CHUNK_ROWS = 100_000
+TABLES = {
+    "food_logs": {"insert": db.FOOD_LOG_INSERT, "required": ["dt", "food_name"], "bulk": nutrition_history.folding,
+                  "cols": ["username", "dt", "food_name", "grams", "kcal", "protein", "carbs", "fat"],
+                  "ranges": {"grams": (0, 10_000), "kcal": (0, 50_000), "protein": (0, 5_000),
+                             "carbs": (0, 5_000), "fat": (0, 5_000)}},
+    "weights": {"insert": db.WEIGHT_INSERT, "required": ["dt", "weight"], "bulk": lambda conn: contextlib.nullcontext(),
+                "cols": ["username", "dt", "weight"], "ranges": {"weight": (20, 400)}},
+}
+# header spellings seen in other trackers' exports -> our column names
+ALIASES = {"date": "dt", "day": "dt", "logged_on": "dt", "user": "username", "food": "food_name",
+           "name": "food_name", "item": "food_name", "description": "food_name", "amount_g": "grams",
+           "quantity_g": "grams", "serving_g": "grams", "calories": "kcal", "energy_kcal": "kcal",
+           "protein_g": "protein", "carbs_g": "carbs", "carbohydrates": "carbs", "carbohydrates_g": "carbs",
+           "fat_g": "fat", "total_fat": "fat", "weight_kg": "weight", "body_weight": "weight"}
+# a UTC offset after a time of day; dropped so a row keeps the local date it was logged on
+UTC_OFFSET = r"^(.*\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)\s*(?:Z|UTC|[+-]\d{2}(?::?\d{2})?)$"
+# what reading and parsing an uploaded file can raise (bad encoding, compression, layout)
+READ_ERRORS = (ValueError, TypeError, OSError, EOFError, zlib.error)
+
+def _column(name) -> str:
+    c = re.sub(r"[^0-9a-z]+", "_", str(name).strip().lower()).strip("_")
+    return ALIASES.get(c, c)
+
+def file_format(name: str) -> str:
+    name = name.lower()
+    if name.endswith((".parquet", ".pq")):
+        return "parquet"
+    return "tsv" if name.endswith((".tsv", ".tsv.gz")) else "csv"
+
+def _pyarrow():
+    try:
+        import pyarrow as pa, pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet needs pyarrow: pip install pyarrow") from None
+    return pa, pq
+
+# ---------- Reading ----------
+def read_chunks(src, fmt: str, chunk_rows: int = CHUNK_ROWS):
+    """DataFrames of at most `chunk_rows` rows from a path or file object."""
+    if fmt == "parquet":
+        _, pq = _pyarrow()
+        for batch in pq.ParquetFile(src).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        name = src if isinstance(src, str) else getattr(src, "name", "")
+        # the C parser types each chunk's columns; normalize() coerces whatever it guessed
+        yield from pd.read_csv(src, sep="\t" if fmt == "tsv" else ",", chunksize=chunk_rows,
+                               compression="gzip" if name.lower().endswith(".gz") else None)
+
+def _parse_date(v: str, dayfirst: bool):
+    try:
+        t = pd.Timestamp(pd.to_datetime(v, dayfirst=dayfirst))
+    except (ValueError, TypeError, OverflowError):
+        return pd.NaT
+    return t.tz_localize(None) if t.tzinfo else t
+
+def parse_dates(raw: pd.Series, dayfirst: bool = False) -> pd.Series:
+    """Naive datetimes for `raw` strings, NaT where unparseable. `dayfirst` settles
+    ambiguous local dates such as 01/02/2024 (1 Feb instead of 2 Jan)."""
+    try:
+        dt = pd.to_datetime(raw, errors="coerce", format="ISO8601")
+    except (ValueError, TypeError):     # mixed UTC offsets: drop them and parse again
+        raw = raw.str.replace(UTC_OFFSET, r"\1", regex=True)
+        dt = pd.to_datetime(raw, errors="coerce", format="ISO8601")
+    if dt.dt.tz is not None:
+        dt = dt.dt.tz_localize(None)
+    retry = dt.isna() & raw.notna()
+    if retry.any():     # other trackers' local formats; slower, so only for what ISO parsing missed
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)    # "inferring format" noise
+            dt[retry] = [_parse_date(v, dayfirst) for v in raw[retry]]
+    return dt
+
+def normalize(df: pd.DataFrame, table: str, username: str = None, dayfirst: bool = False):
+    """(rows ready to insert in TABLES[table]["cols"] order, rejected rows with a `reason`)."""
+    spec, src = TABLES[table], df
+    df = df.rename(columns=_column)
+    df = df.loc[:, ~df.columns.duplicated()]
+    missing = [c for c in ([] if username else ["username"]) + spec["required"] if c not in df.columns]
+    if missing:
+        raise ValueError(f"{table}: missing column(s) {', '.join(missing)}")
+    out = pd.DataFrame(index=df.index)
+    reason = np.full(len(df), "", dtype=object)
+    bad = np.zeros(len(df), dtype=bool)
+
+    def reject(mask, why):
+        first = np.asarray(mask, dtype=bool) & ~bad     # keep the first reason per row
+        reason[first] = why
+        bad[first] = True
+
+    if username is not None:
+        out["username"] = username
+    else:
+        out["username"] = df["username"].astype("string").str.strip()
+        reject(out["username"].isna() | (out["username"] == ""), "missing username")
+    dt = parse_dates(df["dt"].astype("string").str.strip(), dayfirst)
+    reject(dt.isna(), "bad date")
+    out["dt"] = np.datetime_as_string(dt.to_numpy("datetime64[D]"), unit="D")
+    if "food_name" in spec["cols"]:
+        out["food_name"] = df["food_name"].astype("string").str.strip()
+        reject(out["food_name"].isna() | (out["food_name"] == ""), "missing food_name")
+    for col, (lo, hi) in spec["ranges"].items():
+        if col not in df.columns:
+            out[col] = np.nan
+            continue
+        v = pd.to_numeric(df[col], errors="coerce")
+        reject(v.isna() & df[col].notna(), f"{col} not a number")
+        reject((v < lo) | (v > hi), f"{col} out of range")
+        if col in spec["required"]:
+            reject(v.isna(), f"missing {col}")
+        out[col] = v.astype(float)
+    ok = out.loc[~bad, spec["cols"]]
+    # sorted rows land next to each other in the (username, dt) index
+    return ok.sort_values(["username", "dt"], kind="stable"), src.loc[bad].assign(reason=reason[bad])
+
+# ---------- Loading ----------
+def _known_users(conn, names) -> set:
+    names, found = list(names), set()
+    for i in range(0, len(names), 900):          # stay under SQLite's bound-parameter limit
+        part = names[i:i + 900]
+        found.update(r[0] for r in conn.execute(
+            f"SELECT username FROM users WHERE username IN ({','.join('?' * len(part))})", part))
+    return found
+
+def _rows(df: pd.DataFrame, cols):
+    # NaN -> None so SQLite stores NULL; zip over column lists is far quicker than itertuples
+    lists = [df[c].astype(object).where(df[c].notna(), None).tolist() if df[c].hasnans else df[c].tolist()
+             for c in cols]
+    return zip(*lists)
+
+def _prefetch(items):
+    """Iterate `items`, producing the next one on a helper thread meanwhile: parsing and
+    normalizing chunk n+1 overlaps with SQLite inserting chunk n (both release the GIL)."""
+    items = iter(items)
+    with ThreadPoolExecutor(1, thread_name_prefix="carioca-bulk") as ex:
+        fut = ex.submit(next, items, None)
+        while (item := fut.result()) is not None:
+            fut = ex.submit(next, items, None)
+            yield item
+
+def import_chunks(conn, chunks, table: str, username: str = None, on_rejects=None, progress=None,
+                  dayfirst: bool = False) -> dict:
+    """Normalize and insert each chunk in its own transaction; `on_rejects(df)` gets the
+    rows that were set aside."""
+    spec = TABLES[table]
+    stats = {"read": 0, "written": 0, "rejected": 0}
+    for chunk, ok, bad in _prefetch((c, *normalize(c, table, username, dayfirst)) for c in chunks):
+        if username is None and len(ok):
+            known = _known_users(conn, ok["username"].unique())
+            unknown = ~ok["username"].isin(known)
+            if unknown.any():
+                bad = pd.concat([bad, chunk.loc[ok.index[unknown]].assign(reason="unknown user")])
+                ok = ok[~unknown]
+        with conn, spec["bulk"](conn):     # food_logs: rollups folded once per chunk
+            conn.executemany(spec["insert"], _rows(ok, spec["cols"]))
+            # back-dated rows invalidate the adaptive TDEE state; it refits on next read
+            conn.executemany(db.TDEE_STATE_RESET, ((u,) for u in ok["username"].unique().tolist()))
+        stats["read"] += len(chunk)
+        stats["written"] += len(ok)
+        stats["rejected"] += len(bad)
+        if len(bad) and on_rejects:
+            on_rejects(bad)
+        if progress:
+            progress(stats)
+    return stats
+
+def import_file(conn, src, table: str, fmt: str = None, username: str = None,
+                chunk_rows: int = CHUNK_ROWS, on_rejects=None, progress=None, dayfirst: bool = False) -> dict:
+    fmt = fmt or file_format(src if isinstance(src, str) else getattr(src, "name", ""))
+    return import_chunks(conn, read_chunks(src, fmt, chunk_rows), table, username, on_rejects, progress, dayfirst)
+
+# ---------- Export ----------
+def export_chunks(conn, table: str, username: str = None, chunk_rows: int = CHUNK_ROWS):
+    """DataFrames of `table` rows in (dt, id) order, fetched `chunk_rows` at a time. Archived
+    food_logs rows come first, straight from their memory-mapped files."""
+    if table == "food_logs":
+        yield from archive.export_chunks(conn, username)
+    cols = TABLES[table]["cols"]
+    sql = f"SELECT {', '.join(cols)} FROM {table}"
+    if username is not None:
+        sql += " WHERE username=?"
+    cur = conn.execute(sql + " ORDER BY username, dt, id", () if username is None else (username,))
+    while True:
+        rows = cur.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield pd.DataFrame.from_records(rows, columns=cols)
+
+def export_file(conn, path: str, table: str, fmt: str = None, username: str = None, chunk_rows: int = CHUNK_ROWS) -> int:
+    """Write `table` (optionally one user's rows) to `path`; returns the row count."""
+    fmt = fmt or file_format(path)
+    chunks, n = export_chunks(conn, table, username, chunk_rows), 0
+    if fmt == "parquet":
+        pa, pq = _pyarrow()
+        spec = TABLES[table]
+        schema = pa.schema([(c, pa.float64() if c in spec["ranges"] else pa.string()) for c in spec["cols"]])
+        with pq.ParquetWriter(path, schema, compression="zstd") as w:
+            for df in chunks:
+                w.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                n += len(df)
+        return n
+    sep = "\t" if fmt == "tsv" else ","
+    with (gzip.open(path, "wt", newline="") if path.endswith(".gz") else open(path, "w", newline="")) as f:
+        f.write(sep.join(TABLES[table]["cols"]) + "\n")
+        for df in chunks:
+            df.to_csv(f, sep=sep, header=False, index=False)
+            n += len(df)
+    return n
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Carioca bulk import / export")
+    ap.add_argument("cmd", choices=["import", "export"])
+    ap.add_argument("table", choices=list(TABLES))
+    ap.add_argument("path")
+    ap.add_argument("--user", help="import: owner of every row (else a username column is required); export: only this user")
+    ap.add_argument("--format", choices=["csv", "tsv", "parquet"], help="default: from the file extension")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    ap.add_argument("--rejects", help="import: write rejected rows (with a reason column) to this CSV")
+    ap.add_argument("--dayfirst", action="store_true", help="import: read 01/02/2024 as 1 Feb (default: 2 Jan)")
+    ap.add_argument("--db", default=db.DB_PATH)
+    args = ap.parse_args(argv)
+    db.Database(args.db)
+    conn = db.connect(args.db)
+    t0 = time.perf_counter()
+    if args.cmd == "export":
+        n = export_file(conn, args.path, args.table, args.format, args.user, args.chunk_rows)
+        dt = time.perf_counter() - t0
+        print(f"exported {n:,} rows in {dt:.2f}s ({n / max(dt, 1e-9):,.0f} rows/s)", file=sys.stderr)
+        return
+    if args.user and not _known_users(conn, [args.user]):
+        raise SystemExit(f"unknown user {args.user!r}")
+    rejects = None
+    if args.rejects:
+        rejects = open(args.rejects, "w", newline="")
+    def on_rejects(df):
+        df.to_csv(rejects, header=rejects.tell() == 0, index=False)
+    def progress(s):
+        print(f"\r{s['read']:,} read, {s['written']:,} written, {s['rejected']:,} rejected", end="", file=sys.stderr)
+    try:
+        stats = import_file(conn, args.path, args.table, args.format, args.user, args.chunk_rows,
+                            on_rejects if rejects else None, progress, args.dayfirst)
+    except READ_ERRORS as e:
+        raise SystemExit(f"\n{args.path}: {e}") from None
+    finally:
+        if rejects:
+            rejects.close()
+    dt = time.perf_counter() - t0
+    print(f"\nimported {stats['written']:,} of {stats['read']:,} rows in {dt:.2f}s "
+          f"({stats['written'] / max(dt, 1e-9):,.0f} rows/s)", file=sys.stderr)
+    if stats["rejected"] and not rejects:
+        print(f"{stats['rejected']:,} rows rejected; rerun with --rejects FILE to see them", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
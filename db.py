@@ -0,0 +1,91 @@
+"""SQLite connection management for carioca_v2.db.
+
+One `Database` per process (the app holds it in `st.cache_resource`): migrations and
+WAL setup run once there, and every session or worker thread gets its own tuned
+connection from `connect()`. The app's queries live here as named constants so each
+connection's statement cache keeps them prepared across reruns.
+"""
+import os, sqlite3, sys
+import migrations
+
+DB_PATH = os.environ.get("CARIOCA_DB", "carioca_v2.db")
+BUSY_TIMEOUT_MS = int(os.environ.get("CARIOCA_DB_BUSY_TIMEOUT_MS", 5000))
+CACHE_SIZE_KB = int(os.environ.get("CARIOCA_DB_CACHE_KB", 32 * 1024))
+MMAP_SIZE = int(os.environ.get("CARIOCA_DB_MMAP_BYTES", 256 * 1024 * 1024))
+# sqlite3.Connection subclass used for every connection; tooling swaps in timed/traced ones
+CONNECTION_FACTORY = sqlite3.Connection
+
+# ---------- Queries ----------
+USER_AUTH = "SELECT pw_hash, lang, token_gen FROM users WHERE username=?"
+USER_REVOKE_TOKENS = "UPDATE users SET token_gen = token_gen + 1 WHERE username=?"
+USER_SET_PASSWORD = "UPDATE users SET pw_hash=? WHERE username=?"
+USER_INSERT = "INSERT INTO users(username, pw_hash, lang, created_at) VALUES(?,?,?,?)"
+USER_PROFILE = "SELECT username, lang, theme, plan_type, meal_structure, age, sex, height_cm, weight_kg, bodyfat, activity, target_weight, training_days, fasting FROM users WHERE username=?"
+USER_UPDATE = "UPDATE users SET lang=?, theme=?, plan_type=?, meal_structure=?, age=?, sex=?, height_cm=?, weight_kg=?, bodyfat=?, activity=?, target_weight=?, training_days=?, fasting=? WHERE username=?"
+USER_SET_WEIGHT = "UPDATE users SET weight_kg=? WHERE username=?"
+FOOD_LOG_INSERT = "INSERT INTO food_logs(username, dt, food_name, grams, kcal, protein, carbs, fat) VALUES(?,?,?,?,?,?,?,?)"
+FOOD_LOG_DAY = "SELECT food_name, grams, kcal, protein, carbs, fat FROM food_logs WHERE username=? AND dt=?"
+FOOD_LOG_RANGE = "SELECT dt, food_name, grams, kcal, protein, carbs, fat FROM food_logs WHERE username=? AND dt >= ? AND dt <= ? ORDER BY dt, id"
+ARCHIVE_FILES = "SELECT path, dt_min, dt_max, rows FROM food_log_archive WHERE username=? AND dt_max >= ? AND dt_min <= ? ORDER BY dt_min"
+WEIGHT_INSERT = "INSERT INTO weights(username, dt, weight) VALUES(?,?,?)"
+WEIGHT_WINDOW = "SELECT dt, weight FROM weights WHERE username=? AND dt >= ? AND dt <= ? ORDER BY dt"
+# fold food_logs rows past the watermark into the rollups; run both in the inserting transaction
+ROLLUP_REFRESH = migrations.rollup_fold("WHERE f.id > (SELECT watermark FROM rollup_state)")
+ROLLUP_WATERMARK = "UPDATE rollup_state SET watermark = (SELECT COALESCE(MAX(id), 0) FROM food_logs)"
+ROLLUP_PENDING = "SELECT (SELECT COALESCE(MAX(id), 0) FROM food_logs) > (SELECT watermark FROM rollup_state)"
+NUTRITION_DAILY = "SELECT dt, 1 AS days, kcal, protein, carbs, fat, t_kcal IS NOT NULL AS t_days, t_kcal, t_protein, t_carbs, t_fat FROM daily_nutrition WHERE username=? AND dt >= ? AND dt <= ? ORDER BY dt"
+NUTRITION_WEEKLY = "SELECT week AS dt, days, kcal, protein, carbs, fat, t_days, t_kcal, t_protein, t_carbs, t_fat FROM weekly_nutrition WHERE username=? AND week >= ? AND week <= ? ORDER BY week"
+TDEE_STATE = "SELECT through, weight, tdee, p_ww, p_wt, p_tt, intake_days, weigh_ins FROM tdee_state WHERE username=?"
+TDEE_STATE_UPSERT = """INSERT INTO tdee_state(username, through, weight, tdee, p_ww, p_wt, p_tt, intake_days, weigh_ins, updated_at)
+    VALUES(?,?,?,?,?,?,?,?,?,?) ON CONFLICT(username) DO UPDATE SET through=excluded.through, weight=excluded.weight,
+    tdee=excluded.tdee, p_ww=excluded.p_ww, p_wt=excluded.p_wt, p_tt=excluded.p_tt, intake_days=excluded.intake_days,
+    weigh_ins=excluded.weigh_ins, updated_at=excluded.updated_at"""
+TDEE_STATE_RESET = "DELETE FROM tdee_state WHERE username=?"
+TDEE_INTAKE = "SELECT dt, kcal FROM daily_nutrition WHERE username=? AND dt > ? AND dt <= ? ORDER BY dt"
+TDEE_WEIGHTS = "SELECT dt, AVG(weight) AS weight FROM weights WHERE username=? AND dt > ? AND dt <= ? GROUP BY dt ORDER BY dt"
+
+# the per-rerun queries `python migrations.py plan` checks for index use
+HOT_QUERIES = {
+    "login": (USER_AUTH, ("u",)),
+    "profile": (USER_PROFILE, ("u",)),
+    "food_log_day": (FOOD_LOG_DAY, ("u", "2024-01-01")),
+    "weight_window": (WEIGHT_WINDOW, ("u", "2024-01-01", "2024-12-31")),
+    "nutrition_daily": (NUTRITION_DAILY, ("u", "2024-01-01", "2024-12-31")),
+    "nutrition_weekly": (NUTRITION_WEEKLY, ("u", "2024-01-01", "2024-12-31")),
+    "food_log_range": (FOOD_LOG_RANGE, ("u", "2024-01-01", "2024-01-31")),
+    "archive_files": (ARCHIVE_FILES, ("u", "2024-01-01", "2024-01-31")),
+    "tdee_state": (TDEE_STATE, ("u",)),
+    "tdee_intake": (TDEE_INTAKE, ("u", "2024-01-01", "2024-01-31")),
+    "tdee_weights": (TDEE_WEIGHTS, ("u", "2024-01-01", "2024-01-31")),
+}
+
+# ---------- Connections ----------
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    """A tuned connection. Safe to hand between threads as long as one thread uses it at a time
+    (a Streamlit session's reruns are sequential but may run on different threads)."""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=128,
+                           factory=CONNECTION_FACTORY)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+class Database:
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        conn = connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")   # persistent: recorded in the file once
+        migrations.migrate(conn, log=lambda msg: print(f"carioca db: {msg}", file=sys.stderr))
+        conn.close()
+
+    def connect(self) -> sqlite3.Connection:
+        return connect(self.path)
+
+    def session_conn(self, state) -> sqlite3.Connection:
+        """The connection owned by one Streamlit session (kept in its session_state)."""
+        conn = state.get("_db_conn")
+        if conn is None:
+            conn = state["_db_conn"] = self.connect()
+        return conn
@@ -0,0 +1,214 @@
+"""Local OpenFoodFacts catalog: a SQLite FTS5 index built offline from OFF dumps.
+
+Ingest (streams the dump, bounded memory, safe to re-run on a newer dump):
+    python food_index.py ingest openfoodfacts-products.jsonl.gz
+    python food_index.py ingest en.openfoodfacts.org.products.csv.gz
+Query:
+    python food_index.py search "chicken breast" --lang tr
+"""
+import argparse, csv, gzip, io, json, os, re, sqlite3, sys, threading, time
+
+INDEX_PATH = os.environ.get("CARIOCA_FOOD_INDEX", "carioca_foods.db")
+LANGS = ("en", "tr")
+BATCH_ROWS = 5000
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS foods(
+        code TEXT PRIMARY KEY,
+        name TEXT, name_en TEXT, name_tr TEXT, brand TEXT,
+        kcal_100g REAL NOT NULL, protein_100g REAL NOT NULL,
+        carbs_100g REAL NOT NULL, fat_100g REAL NOT NULL,
+        last_modified INTEGER DEFAULT 0
+    )""",
+    # external-content FTS table: the text lives once, in `foods`
+    """CREATE VIRTUAL TABLE IF NOT EXISTS foods_fts USING fts5(
+        name, name_en, name_tr, brand,
+        content='foods', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS foods_ai AFTER INSERT ON foods BEGIN
+        INSERT INTO foods_fts(rowid, name, name_en, name_tr, brand)
+        VALUES (new.rowid, new.name, new.name_en, new.name_tr, new.brand);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS foods_ad AFTER DELETE ON foods BEGIN
+        INSERT INTO foods_fts(foods_fts, rowid, name, name_en, name_tr, brand)
+        VALUES ('delete', old.rowid, old.name, old.name_en, old.name_tr, old.brand);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS foods_au AFTER UPDATE ON foods BEGIN
+        INSERT INTO foods_fts(foods_fts, rowid, name, name_en, name_tr, brand)
+        VALUES ('delete', old.rowid, old.name, old.name_en, old.name_tr, old.brand);
+        INSERT INTO foods_fts(rowid, name, name_en, name_tr, brand)
+        VALUES (new.rowid, new.name, new.name_en, new.name_tr, new.brand);
+    END""",
+]
+
+# only replace a product when the dump carries a newer revision of it; undated rows
+# (no last_modified_t, stored as 0) cannot be compared, so they always refresh
+UPSERT = """INSERT INTO foods(code, name, name_en, name_tr, brand, kcal_100g, protein_100g, carbs_100g, fat_100g, last_modified)
+    VALUES(?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(code) DO UPDATE SET
+        name=excluded.name, name_en=excluded.name_en, name_tr=excluded.name_tr, brand=excluded.brand,
+        kcal_100g=excluded.kcal_100g, protein_100g=excluded.protein_100g,
+        carbs_100g=excluded.carbs_100g, fat_100g=excluded.fat_100g, last_modified=excluded.last_modified
+    WHERE excluded.last_modified = 0 OR excluded.last_modified > COALESCE(foods.last_modified, 0)"""
+
+# ---------- Connections ----------
+def connect(path: str = INDEX_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for ddl in SCHEMA:
+        conn.execute(ddl)
+    conn.commit()
+    return conn
+
+_local = threading.local()
+
+def _reader(path: str):
+    """Per-thread read-only connection; None while no index has been built."""
+    conns = _local.__dict__.setdefault("conns", {})
+    if path not in conns:
+        if not os.path.exists(path):
+            return None
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.execute("PRAGMA query_only=1")
+        conns[path] = conn
+    return conns[path]
+
+# ---------- Search ----------
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def fts_query(text: str) -> str:
+    """Turn free text into an FTS5 MATCH expression: every word, prefix-matched."""
+    return " ".join(f'"{tok}"*' for tok in _TOKEN.findall(text.lower()))
+
+def search(query: str, lang_code: str = "en", limit: int = 20, path: str = INDEX_PATH) -> list:
+    """Ranked rows shaped like `off_search` output; [] when there is no index or no match."""
+    match = fts_query(query)
+    conn = _reader(path)
+    if not match or conn is None:
+        return []
+    lang_col = f"name_{lang_code}" if lang_code in LANGS else "name"
+    # bm25 column weights: name, name_en, name_tr, brand — favour the requested language
+    weights = {"en": "4.0, 6.0, 2.0, 1.0", "tr": "4.0, 2.0, 6.0, 1.0"}.get(lang_code, "6.0, 3.0, 3.0, 1.0")
+    try:
+        cur = conn.execute(f"""SELECT COALESCE(NULLIF(f.{lang_col},''), NULLIF(f.name,''), 'Unnamed'), COALESCE(f.brand,''),
+                    f.kcal_100g, f.protein_100g, f.carbs_100g, f.fat_100g
+                FROM foods_fts JOIN foods f ON f.rowid = foods_fts.rowid
+                WHERE foods_fts MATCH ?
+                ORDER BY bm25(foods_fts, {weights}) LIMIT ?""", (match, int(limit)))
+        return [{"name": n, "brand": b, "kcal_100g": k, "protein_100g": p, "carbs_100g": c, "fat_100g": f}
+                for n, b, k, p, c, f in cur]
+    except sqlite3.Error:
+        return []
+
+# ---------- Dump parsing ----------
+def _num(v):
+    try:
+        return float(v) if v not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+def _row(code, names: dict, brand, kcal, prot, carbs, fat, modified):
+    kcal, prot, carbs, fat = _num(kcal), _num(prot), _num(carbs), _num(fat)
+    if not code or None in (kcal, prot, carbs, fat):
+        return None
+    name = names.get("") or ""
+    if not (name or names.get("en") or names.get("tr")):
+        return None
+    return (str(code), name, names.get("en") or "", names.get("tr") or "", brand or "",
+            kcal, prot, carbs, fat, int(_num(modified) or 0))
+
+def rows_from_jsonl(fh):
+    for line in fh:
+        try:
+            p = json.loads(line)
+        except ValueError:
+            continue
+        nutr = p.get("nutriments") or {}
+        names = {"": p.get("product_name") or p.get("generic_name")}
+        for lang in LANGS:
+            names[lang] = p.get(f"product_name_{lang}") or p.get(f"generic_name_{lang}")
+        row = _row(p.get("code") or p.get("_id"), names, p.get("brands"),
+                   nutr.get("energy-kcal_100g"), nutr.get("proteins_100g"),
+                   nutr.get("carbohydrates_100g"), nutr.get("fat_100g"), p.get("last_modified_t"))
+        if row:
+            yield row
+
+def rows_from_csv(fh):
+    csv.field_size_limit(sys.maxsize)
+    for r in csv.DictReader(fh, delimiter="\t", quoting=csv.QUOTE_NONE):
+        names = {"": r.get("product_name") or r.get("generic_name")}
+        for lang in LANGS:
+            names[lang] = r.get(f"product_name_{lang}") or r.get(f"generic_name_{lang}")
+        row = _row(r.get("code"), names, r.get("brands"),
+                   r.get("energy-kcal_100g"), r.get("proteins_100g"),
+                   r.get("carbohydrates_100g"), r.get("fat_100g"), r.get("last_modified_t"))
+        if row:
+            yield row
+
+def open_dump(path: str):
+    raw = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline="")
+
+# ---------- Ingestion ----------
+def ingest(conn: sqlite3.Connection, path: str, batch_rows: int = BATCH_ROWS, progress=None) -> dict:
+    """Stream a dump into the index in fixed-size transactions; returns counts."""
+    parse = rows_from_csv if ".csv" in path or ".tsv" in path else rows_from_jsonl
+    stats = {"read": 0, "written": 0}
+    with open_dump(path) as fh:
+        batch = []
+        for row in parse(fh):
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                _flush(conn, batch, stats, progress)
+        _flush(conn, batch, stats, progress)
+    return stats
+
+def _flush(conn, batch, stats, progress):
+    if not batch:
+        return
+    with conn:
+        stats["written"] += conn.executemany(UPSERT, batch).rowcount
+    stats["read"] += len(batch)
+    batch.clear()
+    if progress:
+        progress(stats["read"])
+
+def optimize(conn: sqlite3.Connection):
+    conn.execute("INSERT INTO foods_fts(foods_fts) VALUES('optimize')")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build and query the local OpenFoodFacts index")
+    ap.add_argument("--db", default=INDEX_PATH)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_in = sub.add_parser("ingest", help="stream an OFF JSONL/CSV dump (optionally .gz) into the index")
+    p_in.add_argument("dump")
+    p_in.add_argument("--batch", type=int, default=BATCH_ROWS)
+    p_in.add_argument("--no-optimize", action="store_true")
+    p_q = sub.add_parser("search", help="query the index")
+    p_q.add_argument("query")
+    p_q.add_argument("--lang", default="en")
+    p_q.add_argument("--limit", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "ingest":
+        conn = connect(args.db)
+        t0 = time.perf_counter()
+        report = lambda n: print(f"\r{n:,} products parsed", end="", file=sys.stderr)
+        stats = ingest(conn, args.dump, batch_rows=args.batch, progress=report)
+        if not args.no_optimize:
+            optimize(conn)
+        print(f"\nparsed {stats['read']:,}, written {stats['written']:,} in {time.perf_counter()-t0:.1f}s", file=sys.stderr)
+    else:
+        t0 = time.perf_counter()
+        rows = search(args.query, args.lang, args.limit, path=args.db)
+        for r in rows:
+            print(f"{r['name']} ({r['brand']}) — {r['kcal_100g']:.0f} kcal, P {r['protein_100g']} / C {r['carbs_100g']} / F {r['fat_100g']}")
+        print(f"{len(rows)} rows in {(time.perf_counter()-t0)*1000:.1f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Macro-targeted menu planning: for each meal, pick foods and gram amounts from a candidate
+pool so that protein / carbs / fat / kcal land as close as possible to the meal's share of
+the day's `macro_split` targets (weighted non-negative least squares, NumPy only).
+
+Lawson-Hanson NNLS returns a basic solution, so each meal uses at most four foods.
+"""
+import numpy as np
+import pandas as pd
+
+MACRO_COLS = ["protein_100g", "carbs_100g", "fat_100g", "kcal_100g"]
+MEAL_SPLITS = {
+    "two_plus_one": [0.45, 0.45, 0.10],
+    "three_meals": [0.35, 0.35, 0.30],
+    "four_meals": [0.30, 0.30, 0.20, 0.20],
+}
+GRAM_STEP = 5
+MIN_GRAMS = 10
+
+def nnls(A: np.ndarray, b: np.ndarray, tol: float = 1e-10, max_iter: int = None) -> np.ndarray:
+    """argmin ||Ax - b|| subject to x >= 0 (Lawson & Hanson, 1974)."""
+    m, n = A.shape
+    max_iter = max_iter or 3 * n
+    x = np.zeros(n)
+    passive = np.zeros(n, dtype=bool)
+    w = A.T @ b
+    for _ in range(max_iter):
+        if passive.all() or not (w[~passive] > tol).any():
+            break
+        passive[np.argmax(np.where(passive, -np.inf, w))] = True
+        while True:
+            z = np.zeros(n)
+            z[passive] = np.linalg.lstsq(A[:, passive], b, rcond=None)[0]
+            if (z[passive] > tol).all():
+                x = z
+                break
+            # step back toward x until the first passive variable hits zero
+            blocked = passive & (z <= tol)
+            alpha = np.min(x[blocked] / (x[blocked] - z[blocked]))
+            x = x + alpha * (z - x)
+            passive &= x > tol
+            x[~passive] = 0.0
+        w = A.T @ (b - A @ x)
+    return x
+
+def prepare_pool(pool: pd.DataFrame) -> pd.DataFrame:
+    """Drop duplicates and foods without usable macros; index 0..n-1."""
+    pool = pool.dropna(subset=MACRO_COLS)
+    pool = pool[(pool[MACRO_COLS[:3]].sum(axis=1) > 0) & (pool["kcal_100g"] > 0)]
+    return pool.drop_duplicates(subset=["name"] + MACRO_COLS).reset_index(drop=True)
+
+def solve_meal(per100: np.ndarray, target: np.ndarray, allowed: np.ndarray = None):
+    """Grams per food (len = pool size) for one meal's [protein, carbs, fat, kcal] target.
+    Rows are scaled by the target so each macro counts by its relative miss."""
+    scale = 1.0 / np.maximum(target, 1.0)
+    A = (per100.T / 100.0) * scale[:, None]           # per gram
+    cols = np.arange(per100.shape[0]) if allowed is None else np.flatnonzero(allowed)
+    x = np.zeros(per100.shape[0])
+    x[cols] = nnls(A[:, cols], target * scale)
+    grams = np.round(x / GRAM_STEP) * GRAM_STEP
+    grams[grams < MIN_GRAMS] = 0
+    return grams
+
+def plan_day(pool: pd.DataFrame, kcal: float, macros, meal_structure: str = "two_plus_one",
+             avoid=frozenset(), vary: bool = True) -> dict:
+    """One day's menu. `avoid` lists pool rows to skip if the pool is big enough (used to
+    rotate foods across a week); with `vary`, a meal also avoids the previous meal's foods."""
+    pool = pool if "_prepared" in pool.attrs else prepare_pool(pool)
+    per100 = pool[MACRO_COLS].to_numpy(float)
+    day = np.array([*macros, kcal], float)
+    meals, used_day, prev = [], set(), set()
+    for share in MEAL_SPLITS.get(meal_structure, MEAL_SPLITS["two_plus_one"]):
+        skip = set(avoid) | (prev if vary else set())
+        allowed = np.ones(len(pool), dtype=bool)
+        if len(pool) - len(skip) >= 4:
+            allowed[list(skip)] = False
+        grams = solve_meal(per100, day * share, allowed)
+        picked = np.flatnonzero(grams)
+        meals.append({"items": [(pool.at[i, "name"], int(grams[i])) for i in picked],
+                      "target": day * share, "actual": grams @ per100 / 100.0})
+        prev = set(picked)
+        used_day |= prev
+    actual = sum(m["actual"] for m in meals) if meals else np.zeros(4)
+    return {"meals": meals, "target": day, "actual": actual, "used": used_day,
+            "deviation": float(np.abs(actual - day).sum() / max(day.sum(), 1.0))}
+
+def plan_week(pool: pd.DataFrame, day_targets, meal_structure: str = "two_plus_one") -> list:
+    """Menus for a sequence of (kcal, (protein, carbs, fat)) day targets in one call; each
+    day rotates away from the foods used the day before."""
+    pool = prepare_pool(pool)
+    pool.attrs["_prepared"] = True
+    plans, avoid = [], frozenset()
+    for kcal, macros in day_targets:
+        plan = plan_day(pool, kcal, macros, meal_structure, avoid=avoid)
+        plans.append(plan)
+        avoid = frozenset(plan["used"])
+    return plans
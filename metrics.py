@@ -0,0 +1,251 @@
+"""Hot-path instrumentation: timers, traced SQLite connections and `requests` sessions,
+aggregated into fixed-bucket histograms per (metric, labels) and exported as Prometheus
+text or JSON lines.
+
+Off unless CARIOCA_METRICS=1; when off, `timer` hands back a shared null context, `timed`
+returns the function unchanged and nothing is wrapped.
+    CARIOCA_METRICS_JSONL=metrics.jsonl    append a snapshot every CARIOCA_METRICS_INTERVAL s
+    CARIOCA_METRICS_PROM=carioca.prom      rewrite a Prometheus textfile-collector file
+    CARIOCA_ADMINS=alice,bob               users who see the debug sidebar panel
+"""
+import atexit, bisect, contextlib, functools, json, os, re, sqlite3, threading, time
+from collections import deque
+from urllib.parse import urlsplit
+
+ENABLED = os.environ.get("CARIOCA_METRICS", "") not in ("", "0", "false")
+ADMINS = frozenset(u.strip() for u in os.environ.get("CARIOCA_ADMINS", "").split(",") if u.strip())
+JSONL_PATH = os.environ.get("CARIOCA_METRICS_JSONL")
+PROM_PATH = os.environ.get("CARIOCA_METRICS_PROM")
+EXPORT_INTERVAL = float(os.environ.get("CARIOCA_METRICS_INTERVAL", 60))
+PREFIX = "carioca_"
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RECENT_SQL = 50
+
+# ---------- Registry ----------
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count", "max")
+
+    def __init__(self, bounds=SECONDS_BUCKETS):
+        self.bounds, self.counts = bounds, [0] * (len(bounds) + 1)
+        self.sum, self.count, self.max = 0.0, 0, 0.0
+
+    def observe(self, v: float):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+        self.max = max(self.max, v)
+
+    def quantile(self, q: float) -> float:
+        """Linear interpolation inside the bucket holding the q-th observation."""
+        rank, cum, lo = q * self.count, 0, 0.0
+        for hi, c in zip(self.bounds + (self.max,), self.counts):
+            if c and cum + c >= rank:
+                return lo + (min(hi, self.max) - lo) * (rank - cum) / c
+            cum, lo = cum + c, hi
+        return self.max
+
+_lock = threading.Lock()
+_hists = {}          # (name, labels) -> Histogram
+_counters = {}       # (name, labels) -> float
+recent_sql = deque(maxlen=RECENT_SQL)     # [started_at, statement, ms, rows], newest last
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name: str, value: float, **labels):
+    k = _key(name, labels)
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = Histogram()
+        h.observe(value)
+
+def inc(name: str, value: float = 1, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+def reset():
+    with _lock:
+        _hists.clear()
+        _counters.clear()
+        recent_sql.clear()
+
+# ---------- Timers ----------
+_NULL = contextlib.nullcontext()
+
+@contextlib.contextmanager
+def _timer(name, labels):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t, **labels)
+
+def timer(name: str, **labels):
+    """`with timer("plotly_seconds", chart="weight"):` — a no-op context when disabled."""
+    return _timer(name, labels) if ENABLED else _NULL
+
+def timed(name: str, **labels):
+    """Decorator form of `timer`; returns the function itself when disabled."""
+    def wrap(f):
+        if not ENABLED:
+            return f
+        @functools.wraps(f)
+        def inner(*args, **kwargs):
+            with _timer(name, labels):
+                return f(*args, **kwargs)
+        return inner
+    return wrap
+
+# ---------- SQLite ----------
+_ws = re.compile(r"\s+")
+
+def statement_label(sql: str) -> str:
+    return _ws.sub(" ", sql).strip()[:80]
+
+class TracedCursor(sqlite3.Cursor):
+    """Records execute time, fetch time and rows per statement; `_entry` is this cursor's
+    row in `recent_sql` so fetches can add their rows to it."""
+    _entry = None
+
+    def _run(self, method, sql, args):
+        label = statement_label(sql)
+        t = time.perf_counter()
+        try:
+            return method(self, sql, *args)
+        finally:
+            dt = time.perf_counter() - t
+            rows = max(self.rowcount, 0)
+            observe("sqlite_query_seconds", dt, stmt=label)
+            if rows:
+                inc("sqlite_rows_total", rows, stmt=label)
+            self._entry = [time.time(), label, dt * 1000, rows]
+            recent_sql.append(self._entry)
+
+    def execute(self, sql, *args):
+        return self._run(sqlite3.Cursor.execute, sql, args)
+
+    def executemany(self, sql, *args):
+        return self._run(sqlite3.Cursor.executemany, sql, args)
+
+    def _fetch(self, method, *args):
+        t = time.perf_counter()
+        rows = method(self, *args)
+        if self._entry is not None:
+            n = len(rows) if isinstance(rows, list) else int(rows is not None)
+            observe("sqlite_fetch_seconds", time.perf_counter() - t, stmt=self._entry[1])
+            if n:
+                inc("sqlite_rows_total", n, stmt=self._entry[1])
+            self._entry[3] += n
+        return rows
+
+    def fetchone(self):
+        return self._fetch(sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(sqlite3.Cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(sqlite3.Cursor.fetchall)
+
+class TracedConnection(sqlite3.Connection):
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+# ---------- HTTP ----------
+def trace_session(s):
+    """Time every request sent through `s`, labelled by host and status (or exception type)."""
+    if not ENABLED or getattr(s, "_carioca_traced", False):
+        return s
+    send = s.send
+
+    def traced_send(request, **kwargs):
+        host = urlsplit(request.url).netloc
+        t = time.perf_counter()
+        try:
+            r = send(request, **kwargs)
+        except Exception as e:
+            observe("http_request_seconds", time.perf_counter() - t, host=host, status=type(e).__name__)
+            raise
+        observe("http_request_seconds", time.perf_counter() - t, host=host, status=str(r.status_code))
+        return r
+    s.send, s._carioca_traced = traced_send, True
+    return s
+
+# ---------- Export ----------
+def snapshot() -> dict:
+    with _lock:
+        hists = [{"name": n, "labels": dict(l), "count": h.count, "sum": h.sum, "max": h.max,
+                  "p50": h.quantile(0.5), "p95": h.quantile(0.95), "p99": h.quantile(0.99),
+                  "buckets": dict(zip([*map(str, h.bounds), "+Inf"], h.counts))}
+                 for (n, l), h in _hists.items()]
+        counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _counters.items()]
+    return {"ts": time.time(), "histograms": hists, "counters": counters}
+
+def _labels(labels: dict, **extra) -> str:
+    items = {**labels, **extra}
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items.items()) + "}"
+
+def prometheus_text(snap: dict = None) -> str:
+    snap = snap or snapshot()
+    lines, typed = [], set()
+    for h in sorted(snap["histograms"], key=lambda h: h["name"]):
+        name = PREFIX + h["name"]
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cum = 0
+        for le, c in h["buckets"].items():
+            cum += c
+            lines.append(f"{name}_bucket{_labels(h['labels'], le=le)} {cum}")
+        lines.append(f"{name}_sum{_labels(h['labels'])} {h['sum']:.6f}")
+        lines.append(f"{name}_count{_labels(h['labels'])} {h['count']}")
+    for c in sorted(snap["counters"], key=lambda c: c["name"]):
+        name = PREFIX + c["name"]
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_labels(c['labels'])} {c['value']:g}")
+    return "\n".join(lines) + "\n"
+
+def export(jsonl_path: str = None, prom_path: str = None):
+    snap = snapshot()
+    if jsonl_path:
+        with open(jsonl_path, "a") as f:
+            f.write(json.dumps(snap) + "\n")
+    if prom_path:
+        tmp = prom_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(prometheus_text(snap))
+        os.replace(tmp, prom_path)      # scrapers never see a half-written file
+
+def _export_loop(stop: threading.Event):
+    while not stop.wait(EXPORT_INTERVAL):
+        export(JSONL_PATH, PROM_PATH)
+
+# ---------- Install ----------
+_installed = False
+
+def install():
+    """Route new db connections through TracedConnection and start the periodic exporter.
+    Idempotent; does nothing when disabled."""
+    global _installed
+    if not ENABLED or _installed:
+        return
+    import db
+    db.CONNECTION_FACTORY = TracedConnection
+    if JSONL_PATH or PROM_PATH:
+        stop = threading.Event()
+        threading.Thread(target=_export_loop, args=(stop,), name="carioca-metrics", daemon=True).start()
+        atexit.register(lambda: (stop.set(), export(JSONL_PATH, PROM_PATH)))
+    _installed = True
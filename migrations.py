@@ -0,0 +1,290 @@
+"""Versioned schema migrations for carioca_v2.db, tracked in PRAGMA user_version.
+
+Applied automatically when the app starts (db.Database), or from the CLI:
+    python migrations.py status
+    python migrations.py migrate
+    python migrations.py plan        # EXPLAIN QUERY PLAN for the app's hot queries
+"""
+import argparse, sqlite3, sys
+
+# dates are stored as ISO text; the CHECK keeps anything else out of the typed columns
+ISO_DATE = "CHECK (dt GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]')"
+
+def _baseline(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS users(
+        username TEXT PRIMARY KEY,
+        pw_hash BLOB NOT NULL,
+        lang TEXT DEFAULT 'en',
+        theme TEXT DEFAULT 'tropical',
+        plan_type TEXT DEFAULT 'full_body',
+        meal_structure TEXT DEFAULT 'two_plus_one',
+        age INT, sex TEXT, height_cm REAL, weight_kg REAL, bodyfat REAL,
+        activity TEXT, target_weight REAL, training_days INT, fasting TEXT,
+        created_at TEXT
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS weights(
+        username TEXT, dt TEXT, weight REAL
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS food_logs(
+        username TEXT, dt TEXT, food_name TEXT, grams REAL,
+        kcal REAL, protein REAL, carbs REAL, fat REAL
+    )""")
+
+def _keys_dates_indexes(conn):
+    """Rebuild weights/food_logs with surrogate keys, typed dates and (username, dt) indexes.
+    Rows that cannot be normalized are kept in migration_rejects instead of being dropped."""
+    conn.execute("""CREATE TABLE IF NOT EXISTS migration_rejects(
+        id INTEGER PRIMARY KEY, table_name TEXT NOT NULL, row_json TEXT NOT NULL,
+        rejected_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )""")
+    conn.execute("ALTER TABLE weights RENAME TO weights_v1")
+    conn.execute("ALTER TABLE food_logs RENAME TO food_logs_v1")
+    conn.execute(f"""CREATE TABLE weights(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        dt DATE NOT NULL {ISO_DATE},
+        weight REAL NOT NULL
+    )""")
+    conn.execute(f"""CREATE TABLE food_logs(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        dt DATE NOT NULL {ISO_DATE},
+        food_name TEXT NOT NULL DEFAULT '',
+        grams REAL, kcal REAL, protein REAL, carbs REAL, fat REAL
+    )""")
+    conn.execute("""INSERT INTO weights(username, dt, weight)
+        SELECT username, date(dt), weight FROM weights_v1
+        WHERE username IS NOT NULL AND date(dt) IS NOT NULL AND weight IS NOT NULL ORDER BY rowid""")
+    conn.execute("""INSERT INTO migration_rejects(table_name, row_json)
+        SELECT 'weights', json_object('username', username, 'dt', dt, 'weight', weight) FROM weights_v1
+        WHERE username IS NULL OR date(dt) IS NULL OR weight IS NULL""")
+    conn.execute("""INSERT INTO food_logs(username, dt, food_name, grams, kcal, protein, carbs, fat)
+        SELECT username, date(dt), COALESCE(food_name, ''), grams, kcal, protein, carbs, fat FROM food_logs_v1
+        WHERE username IS NOT NULL AND date(dt) IS NOT NULL ORDER BY rowid""")
+    conn.execute("""INSERT INTO migration_rejects(table_name, row_json)
+        SELECT 'food_logs', json_object('username', username, 'dt', dt, 'food_name', food_name, 'grams', grams,
+                                        'kcal', kcal, 'protein', protein, 'carbs', carbs, 'fat', fat) FROM food_logs_v1
+        WHERE username IS NULL OR date(dt) IS NULL""")
+    conn.execute("DROP TABLE weights_v1")
+    conn.execute("DROP TABLE food_logs_v1")
+    conn.execute("CREATE INDEX idx_weights_user_dt ON weights(username, dt)")
+    conn.execute("CREATE INDEX idx_food_logs_user_dt ON food_logs(username, dt)")
+    conn.execute("ANALYZE")
+
+def _user_targets(conn):
+    conn.execute("""CREATE TABLE user_targets(
+        username TEXT PRIMARY KEY REFERENCES users(username) ON DELETE CASCADE,
+        inputs TEXT NOT NULL,
+        bmr REAL, tdee REAL, wcal REAL, rcal REAL,
+        p_w REAL, c_w REAL, f_w REAL, p_r REAL, c_r REAL, f_r REAL,
+        computed_at TEXT
+    )""")
+
+# ---------- Nutrition rollups ----------
+_SUMS = ["kcal", "protein", "carbs", "fat"]
+_TARGETS = ["t_kcal", "t_protein", "t_carbs", "t_fat"]
+WEEK_OF = "date({}, '-6 days', 'weekday 1')"      # Monday on or before the date
+
+def _targets(u, dt):
+    """Day-type targets from user_targets row `u` for date `dt`. Workout days are Mon/Wed/Fri
+    (plan_engine.WORKOUT_WEEKDAYS), i.e. strftime('%w') 1, 3, 5."""
+    workout = f"strftime('%w', {dt}) IN ('1','3','5')"
+    return ", ".join(f"CASE WHEN {workout} THEN {u}.{w} ELSE {u}.{r} END"
+                     for w, r in [("wcal", "rcal"), ("p_w", "p_r"), ("c_w", "c_r"), ("f_w", "f_r")])
+
+def rollup_fold(where: str) -> str:
+    """Grouped upsert of the food_logs rows matching `where` into daily_nutrition. Rows are
+    read by rowid (NOT INDEXED: walking idx_food_logs_user_dt to skip the GROUP BY sort
+    visits the whole table) and targets are joined once per day, after grouping."""
+    return f"""INSERT INTO daily_nutrition(username, dt, entries, {", ".join(_SUMS)}, {", ".join(_TARGETS)})
+        SELECT g.username, g.dt, g.entries, {", ".join(f"g.{c}" for c in _SUMS)}, {_targets("u", "g.dt")}
+        FROM (SELECT f.username, f.dt, COUNT(*) AS entries, {", ".join(f"SUM(COALESCE(f.{c}, 0)) AS {c}" for c in _SUMS)}
+              FROM food_logs f NOT INDEXED {where} GROUP BY f.username, f.dt) g
+        LEFT JOIN user_targets u ON u.username = g.username
+        WHERE true
+        ON CONFLICT(username, dt) DO UPDATE SET entries = entries + excluded.entries,
+            {", ".join(f"{c} = {c} + excluded.{c}" for c in _SUMS)}"""
+
+def _add_log(r):
+    return f"""INSERT INTO daily_nutrition(username, dt, entries, {", ".join(_SUMS)}, {", ".join(_TARGETS)})
+            SELECT {r}.username, {r}.dt, 1, {", ".join(f"COALESCE({r}.{c}, 0)" for c in _SUMS)}, {_targets("u", f"{r}.dt")}
+            FROM (SELECT 1) LEFT JOIN user_targets u ON u.username = {r}.username
+            WHERE {r}.id <= (SELECT watermark FROM rollup_state)
+            ON CONFLICT(username, dt) DO UPDATE SET entries = entries + 1,
+                {", ".join(f"{c} = {c} + excluded.{c}" for c in _SUMS)};"""
+
+def _drop_log(r):
+    return f"""UPDATE daily_nutrition SET entries = entries - 1,
+                {", ".join(f"{c} = {c} - COALESCE({r}.{c}, 0)" for c in _SUMS)}
+            WHERE username = {r}.username AND dt = {r}.dt AND {r}.id <= (SELECT watermark FROM rollup_state);
+            DELETE FROM daily_nutrition WHERE username = {r}.username AND dt = {r}.dt AND entries <= 0;"""
+
+WEEKLY_FROM_DAILY = f"""INSERT INTO weekly_nutrition(username, week, days, {", ".join(_SUMS)}, t_days, {", ".join(_TARGETS)})
+    SELECT username, {WEEK_OF.format("dt")}, COUNT(*), {", ".join(f"SUM({c})" for c in _SUMS)},
+           COUNT(t_kcal), {", ".join(f"SUM(COALESCE({c}, 0))" for c in _TARGETS)}
+    FROM daily_nutrition GROUP BY 1, 2"""
+
+def _rollup_triggers():
+    # Inserts reach the rollups by folding food_logs rows past rollup_state.watermark (one
+    # grouped upsert per write batch, see db.ROLLUP_REFRESH); these triggers only correct
+    # rollups for rows already folded when they are later changed or deleted.
+    week = lambda r: f"username = {r}.username AND week = {WEEK_OF.format(f'{r}.dt')}"
+    return [
+        f"CREATE TRIGGER food_logs_rollup_del AFTER DELETE ON food_logs BEGIN {_drop_log('OLD')} END",
+        f"""CREATE TRIGGER food_logs_rollup_upd AFTER UPDATE OF username, dt, kcal, protein, carbs, fat ON food_logs
+            BEGIN {_drop_log('OLD')} {_add_log('NEW')} END""",
+        f"""CREATE TRIGGER daily_nutrition_week_ins AFTER INSERT ON daily_nutrition BEGIN
+            INSERT INTO weekly_nutrition(username, week, days, {", ".join(_SUMS)}, t_days, {", ".join(_TARGETS)})
+            VALUES(NEW.username, {WEEK_OF.format("NEW.dt")}, 1, {", ".join(f"NEW.{c}" for c in _SUMS)},
+                   NEW.t_kcal IS NOT NULL, {", ".join(f"COALESCE(NEW.{c}, 0)" for c in _TARGETS)})
+            ON CONFLICT(username, week) DO UPDATE SET days = days + 1, t_days = t_days + excluded.t_days,
+                {", ".join(f"{c} = {c} + excluded.{c}" for c in _SUMS + _TARGETS)};
+        END""",
+        f"""CREATE TRIGGER daily_nutrition_week_upd AFTER UPDATE ON daily_nutrition BEGIN
+            UPDATE weekly_nutrition SET {", ".join(f"{c} = {c} + NEW.{c} - OLD.{c}" for c in _SUMS)},
+                t_days = t_days + (NEW.t_kcal IS NOT NULL) - (OLD.t_kcal IS NOT NULL),
+                {", ".join(f"{c} = {c} + COALESCE(NEW.{c}, 0) - COALESCE(OLD.{c}, 0)" for c in _TARGETS)}
+            WHERE {week('NEW')};
+        END""",
+        f"""CREATE TRIGGER daily_nutrition_week_del AFTER DELETE ON daily_nutrition BEGIN
+            UPDATE weekly_nutrition SET days = days - 1, {", ".join(f"{c} = {c} - OLD.{c}" for c in _SUMS)},
+                t_days = t_days - (OLD.t_kcal IS NOT NULL),
+                {", ".join(f"{c} = {c} - COALESCE(OLD.{c}, 0)" for c in _TARGETS)}
+            WHERE {week('OLD')};
+            DELETE FROM weekly_nutrition WHERE {week('OLD')} AND days <= 0;
+        END""",
+    ]
+
+def _nutrition_rollups(conn):
+    """Per-user daily and weekly intake totals, with the day-type targets in force when a day
+    was first logged, maintained incrementally so history never rescans food_logs."""
+    conn.execute(f"""CREATE TABLE daily_nutrition(
+        username TEXT NOT NULL, dt DATE NOT NULL {ISO_DATE}, entries INTEGER NOT NULL,
+        kcal REAL NOT NULL, protein REAL NOT NULL, carbs REAL NOT NULL, fat REAL NOT NULL,
+        t_kcal REAL, t_protein REAL, t_carbs REAL, t_fat REAL,
+        PRIMARY KEY (username, dt)
+    ) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE weekly_nutrition(
+        username TEXT NOT NULL, week DATE NOT NULL, days INTEGER NOT NULL,
+        kcal REAL NOT NULL, protein REAL NOT NULL, carbs REAL NOT NULL, fat REAL NOT NULL,
+        t_days INTEGER NOT NULL, t_kcal REAL NOT NULL, t_protein REAL NOT NULL, t_carbs REAL NOT NULL, t_fat REAL NOT NULL,
+        PRIMARY KEY (username, week)
+    ) WITHOUT ROWID""")
+    # watermark: highest food_logs.id already folded into daily_nutrition
+    conn.execute("CREATE TABLE rollup_state(id INTEGER PRIMARY KEY CHECK (id = 1), watermark INTEGER NOT NULL)")
+    conn.execute("INSERT INTO rollup_state SELECT 1, COALESCE(MAX(id), 0) FROM food_logs")
+    conn.execute(rollup_fold("WHERE true"))
+    conn.execute(WEEKLY_FROM_DAILY)
+    for sql in _rollup_triggers():
+        conn.execute(sql)
+
+def _tdee_state(conn):
+    # Kalman filter state per user (see tdee_estimator): days up to `through` are folded in
+    conn.execute("""CREATE TABLE tdee_state(
+        username TEXT PRIMARY KEY REFERENCES users(username) ON DELETE CASCADE,
+        through DATE NOT NULL CHECK (through GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'),
+        weight REAL, tdee REAL NOT NULL, p_ww REAL NOT NULL, p_wt REAL NOT NULL, p_tt REAL NOT NULL,
+        intake_days INTEGER NOT NULL, weigh_ins INTEGER NOT NULL, updated_at TEXT
+    ) WITHOUT ROWID""")
+
+def _food_log_archive(conn):
+    """Manifest of archived food_logs files (see archive.py). Rows moved to cold storage leave
+    their rollups in place, so the delete trigger stands aside while rollup_state.archiving is set."""
+    conn.execute("""CREATE TABLE food_log_archive(
+        username TEXT NOT NULL, path TEXT NOT NULL,
+        dt_min DATE NOT NULL, dt_max DATE NOT NULL, max_id INTEGER NOT NULL,
+        rows INTEGER NOT NULL, bytes INTEGER NOT NULL, created_at TEXT NOT NULL,
+        PRIMARY KEY (username, path)
+    ) WITHOUT ROWID""")
+    conn.execute("ALTER TABLE rollup_state ADD COLUMN archiving INTEGER NOT NULL DEFAULT 0")
+    conn.execute("DROP TRIGGER food_logs_rollup_del")
+    conn.execute(f"""CREATE TRIGGER food_logs_rollup_del AFTER DELETE ON food_logs
+        WHEN (SELECT archiving FROM rollup_state) = 0 BEGIN {_drop_log('OLD')} END""")
+
+def _token_gen(conn):
+    # session tokens carry the generation they were issued under; logout bumps it (see auth.py)
+    conn.execute("ALTER TABLE users ADD COLUMN token_gen INTEGER NOT NULL DEFAULT 0")
+
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "surrogate keys, typed dates, (username, dt) indexes", _keys_dates_indexes),
+    (3, "precomputed plan targets", _user_targets),
+    (4, "daily / weekly nutrition rollups", _nutrition_rollups),
+    (5, "adaptive TDEE filter state", _tdee_state),
+    (6, "food_logs cold-storage manifest", _food_log_archive),
+    (7, "session token generation", _token_gen),
+]
+
+# ---------- Runner ----------
+def current_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection, target: int = None, log=None) -> list:
+    """Apply pending migrations, each in its own IMMEDIATE transaction so concurrent
+    starters serialize and re-check the version. Returns the versions applied here."""
+    target = MIGRATIONS[-1][0] if target is None else target
+    applied = []
+    saved, conn.isolation_level = conn.isolation_level, None
+    try:
+        for version, name, step in MIGRATIONS:
+            if version > target or version <= current_version(conn):
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if version <= current_version(conn):   # another process got here first
+                    conn.execute("ROLLBACK")
+                    continue
+                step(conn)
+                conn.execute(f"PRAGMA user_version={version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(version)
+            if log:
+                log(f"applied migration {version}: {name}")
+    finally:
+        conn.isolation_level = saved
+    return applied
+
+def query_plans(conn, queries: dict) -> dict:
+    """{name: [plan detail lines]} for each (sql, sample params) in `queries`."""
+    return {name: [r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            for name, (sql, params) in queries.items()}
+
+def full_scans(plans: dict) -> list:
+    return [name for name, lines in plans.items()
+            if any(l.startswith("SCAN") and "USING" not in l for l in lines)]
+
+# ---------- CLI ----------
+def main(argv=None):
+    import db
+    ap = argparse.ArgumentParser(description="Carioca schema migrations")
+    ap.add_argument("cmd", choices=["status", "migrate", "plan"])
+    ap.add_argument("--db", default=db.DB_PATH)
+    ap.add_argument("--target", type=int)
+    args = ap.parse_args(argv)
+    if args.cmd == "plan":
+        db.Database(args.db)        # the hot queries need the current schema
+    conn = db.connect(args.db)
+    if args.cmd == "migrate":
+        conn.execute("PRAGMA journal_mode=WAL")
+        applied = migrate(conn, args.target, log=print)
+        print(f"at version {current_version(conn)}" + ("" if applied else " (nothing to apply)"))
+    elif args.cmd == "status":
+        v = current_version(conn)
+        for version, name, _ in MIGRATIONS:
+            print(f"{'x' if version <= v else ' '} {version:3d}  {name}")
+    else:
+        plans = query_plans(conn, db.HOT_QUERIES)
+        for name, lines in plans.items():
+            print(name)
+            for line in lines:
+                print(f"    {line}")
+        scans = full_scans(plans)
+        if scans:
+            print(f"full table scans: {', '.join(scans)}", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
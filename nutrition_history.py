@@ -0,0 +1,98 @@
+"""Nutrition history for the Progress tab, read only from the daily_nutrition / weekly_nutrition
+rollups (migration 4). Writers fold new food_logs rows into them past a watermark in the
+same transaction; triggers correct them when logged rows change. A chart is one index range read
+of at most a few hundred rollup rows, however many food_logs rows sit behind them.
+
+    python nutrition_history.py rebuild        # recompute both rollups from food_logs
+"""
+import argparse, contextlib, sys, time
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import db, migrations, plan_engine
+
+MACROS = ["kcal", "protein", "carbs", "fat"]
+DAILY_MAX_DAYS = 90         # longer windows are charted from weekly rows
+
+def grain(start: date, end: date) -> str:
+    return "daily" if start != date.min and (end - start).days <= DAILY_MAX_DAYS else "weekly"
+
+def load(conn, username: str, start: date, end: date) -> pd.DataFrame:
+    """Daily or weekly rollup rows in [start, end] (see `grain`)."""
+    if grain(start, end) == "daily":
+        return pd.read_sql_query(db.NUTRITION_DAILY, conn, params=(username, start.isoformat(), end.isoformat()))
+    monday = start - timedelta(days=start.weekday()) if start != date.min else start
+    return pd.read_sql_query(db.NUTRITION_WEEKLY, conn, params=(username, monday.isoformat(), end.isoformat()))
+
+def with_adherence(df: pd.DataFrame, fallback=None) -> pd.DataFrame:
+    """Per-day average intake and target for each row, `<macro>_pct` of target and an overall
+    `adherence` score (0-100, mean over kcal and macros of 1 - |miss| / target).
+    `fallback = {"workout": (kcal, p, c, f), "rest": (...)}` fills days logged before any
+    targets were stored."""
+    df = df.assign(dt=pd.to_datetime(df["dt"]))
+    days = df["days"].to_numpy(float)
+    t_days = df["t_days"].to_numpy(float)
+    actual = df[MACROS].to_numpy(float) / days[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        target = df[[f"t_{m}" for m in MACROS]].to_numpy(float) / t_days[:, None]
+    if fallback is not None:
+        workout = df["dt"].dt.weekday.isin(plan_engine.WORKOUT_WEEKDAYS).to_numpy()
+        fill = np.where(workout[:, None], np.array(fallback["workout"], float), np.array(fallback["rest"], float))
+        target = np.where(np.isnan(target), fill, target)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = actual / target
+        score = np.clip(1 - np.abs(1 - ratio), 0, 1)
+        overall = np.nansum(score, axis=1) / (~np.isnan(score)).sum(axis=1)
+    out = df[["dt"]].copy()
+    for i, m in enumerate(MACROS):
+        out[m] = actual[:, i].round(1)
+        out[f"t_{m}"] = target[:, i].round(1)
+        out[f"{m}_pct"] = (ratio[:, i] * 100).round(1)
+    out["adherence"] = (overall * 100).round(1)
+    return out
+
+REFRESH = [(db.ROLLUP_REFRESH, ()), (db.ROLLUP_WATERMARK, ())]
+
+@contextlib.contextmanager
+def folding(conn):
+    """Inside a transaction that inserts food_logs rows: fold them into the rollups with one
+    grouped upsert when the block ends, before the transaction commits."""
+    yield
+    for sql, params in REFRESH:
+        conn.execute(sql, params)
+
+def refresh(conn):
+    """Fold rows some other writer left past the watermark; a cheap read when there are none."""
+    if conn.execute(db.ROLLUP_PENDING).fetchone()[0]:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")     # read the watermark under the write lock
+            for sql, params in REFRESH:
+                conn.execute(sql, params)
+
+# days a user has moved to cold storage (archive.py) survive only in the rollups, so keep them
+_LIVE = "{}dt > COALESCE((SELECT MAX(a.dt_max) FROM food_log_archive a WHERE a.username = {}username), '')"
+
+def rebuild(conn):
+    """Recompute both rollups from food_logs, keeping the days already archived."""
+    with conn:
+        conn.execute("DELETE FROM daily_nutrition WHERE " + _LIVE.format("", "daily_nutrition."))
+        conn.execute(migrations.rollup_fold("WHERE " + _LIVE.format("f.", "f.")))
+        conn.execute("DELETE FROM weekly_nutrition")       # recount from the daily rows
+        conn.execute(migrations.WEEKLY_FROM_DAILY)
+        conn.execute(db.ROLLUP_WATERMARK)
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Carioca nutrition rollups")
+    ap.add_argument("cmd", choices=["rebuild"])
+    ap.add_argument("--db", default=db.DB_PATH)
+    args = ap.parse_args(argv)
+    db.Database(args.db)
+    conn = db.connect(args.db)
+    t0 = time.perf_counter()
+    rebuild(conn)
+    n = conn.execute("SELECT COUNT(*) FROM daily_nutrition").fetchone()[0]
+    print(f"rebuilt {n:,} daily rollups in {time.perf_counter()-t0:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Two-tier cache for OpenFoodFacts lookups: in-process LRU in front of a shared SQLite store.
+
+Entries are fresh for `ttl` seconds; after that they are still served for up to
+`stale_ttl` more seconds while a background refresh runs (stale-while-revalidate).
+Empty results and failed lookups are cached for the shorter `negative_ttl`. Concurrent
+misses on one key share a single load.
+
+    python off_cache.py stats     # disk-tier summary, plus the last exported hit/miss counters
+    python off_cache.py prune     # drop entries past their stale window
+"""
+import argparse, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import metrics
+
+CACHE_PATH = os.environ.get("CARIOCA_OFF_CACHE", "carioca_off_cache.db")
+TTL = float(os.environ.get("CARIOCA_OFF_CACHE_TTL", 6 * 3600))
+STALE_TTL = float(os.environ.get("CARIOCA_OFF_CACHE_STALE_TTL", 7 * 24 * 3600))
+NEGATIVE_TTL = float(os.environ.get("CARIOCA_OFF_CACHE_NEGATIVE_TTL", 120))
+MAX_ITEMS = int(os.environ.get("CARIOCA_OFF_CACHE_ITEMS", 2048))
+MAX_DISK_ROWS = int(os.environ.get("CARIOCA_OFF_CACHE_DISK_ROWS", 200_000))
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS off_cache(
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    negative INTEGER NOT NULL DEFAULT 0
+)"""
+
+def make_key(query: str, lang_code: str, page_size: int) -> str:
+    return json.dumps([" ".join(query.lower().split()), lang_code, int(page_size)])
+
+class TieredCache:
+    def __init__(self, path=CACHE_PATH, max_items=MAX_ITEMS, ttl=TTL, stale_ttl=STALE_TTL,
+                 negative_ttl=NEGATIVE_TTL, max_disk_rows=MAX_DISK_ROWS, refresh_workers=2):
+        self.path, self.max_items = path, max_items
+        self.ttl, self.stale_ttl, self.negative_ttl = ttl, stale_ttl, negative_ttl
+        self.max_disk_rows = max_disk_rows
+        self._mem = OrderedDict()            # key -> (rows, stored_at, negative)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._inflight = set()
+        self._loading = {}                   # key -> Future of the one cold-miss load in progress
+        self._pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="off-cache")
+        self._writes = 0
+        self.counters = dict.fromkeys(
+            ["mem_hits", "disk_hits", "misses", "coalesced", "stale_served", "negative_hits",
+             "evictions", "refreshes", "load_errors"], 0)
+        with self._db() as db:
+            db.execute(SCHEMA)
+
+    # ---------- tiers ----------
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+        if metrics.ENABLED:
+            metrics.inc("off_cache_events_total", n, event=name)
+
+    def _mem_put(self, key, entry):
+        evicted = 0
+        with self._lock:
+            self._mem[key] = entry
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+                evicted += 1
+            self.counters["evictions"] += evicted
+        if evicted and metrics.ENABLED:
+            metrics.inc("off_cache_events_total", evicted, event="evictions")
+
+    def _lookup(self, key):
+        """(entry, tier) from the fastest tier holding `key`, or (None, None)."""
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                self._mem.move_to_end(key)
+                return entry, "mem"
+        try:
+            row = self._db().execute("SELECT payload, stored_at, negative FROM off_cache WHERE key=?", (key,)).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            return None, None
+        entry = (json.loads(row[0]), row[1], bool(row[2]))
+        self._mem_put(key, entry)
+        return entry, "disk"
+
+    def _store(self, key, rows, negative):
+        entry = (rows, time.time(), negative)
+        self._mem_put(key, entry)
+        try:
+            with self._db() as db:
+                db.execute("INSERT OR REPLACE INTO off_cache(key, payload, stored_at, negative) VALUES(?,?,?,?)",
+                           (key, json.dumps(rows), entry[1], int(negative)))
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % 500 == 0
+            if prune:
+                self.prune()
+        except sqlite3.Error:
+            pass   # the disk tier is best-effort; the memory tier still holds the entry
+        return entry
+
+    # ---------- loading ----------
+    def _load(self, key, loader, previous=None):
+        """Run the loader and cache its outcome; a failure never replaces good stale rows."""
+        try:
+            rows = loader()
+        except Exception:
+            self._count("load_errors")
+            if previous is not None and not previous[2]:
+                return previous
+            return self._store(key, [], negative=True)
+        return self._store(key, rows, negative=not rows)
+
+    def _refresh(self, key, loader, previous):
+        try:
+            self._load(key, loader, previous)
+            self._count("refreshes")
+        finally:
+            with self._lock:
+                self._inflight.discard(key)
+
+    def get(self, key: str, loader) -> list:
+        """Cached rows for `key`; `loader()` returns fresh rows and raises on failure."""
+        entry, tier = self._lookup(key)
+        if entry is not None:
+            rows, stored_at, negative = entry
+            age = time.time() - stored_at
+            if negative:
+                if age < self.negative_ttl:
+                    self._count(f"{tier}_hits")
+                    self._count("negative_hits")
+                    return rows
+            elif age < self.ttl:
+                self._count(f"{tier}_hits")
+                return rows
+            elif age < self.ttl + self.stale_ttl:
+                self._count(f"{tier}_hits")
+                self._count("stale_served")
+                with self._lock:
+                    start = key not in self._inflight
+                    self._inflight.add(key)
+                if start:
+                    self._pool.submit(self._refresh, key, loader, entry)
+                return rows
+        self._count("misses")
+        # single flight: concurrent misses on one key wait for the first caller's load
+        with self._lock:
+            fut = self._loading.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._loading[key] = Future()
+        if not leader:
+            self._count("coalesced")
+            return fut.result()[0]
+        try:
+            entry = self._load(key, loader, entry)
+            fut.set_result(entry)
+            return entry[0]
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+
+    # ---------- maintenance ----------
+    def prune(self):
+        """Drop disk entries past their serving window, then cap the table size."""
+        now = time.time()
+        with self._db() as db:
+            db.execute("DELETE FROM off_cache WHERE (negative=1 AND stored_at < ?) OR stored_at < ?",
+                       (now - self.negative_ttl, now - self.ttl - self.stale_ttl))
+            db.execute("""DELETE FROM off_cache WHERE key IN (
+                SELECT key FROM off_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)""", (self.max_disk_rows,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self.counters, mem_items=len(self._mem), inflight=len(self._inflight))
+        lookups = out["mem_hits"] + out["disk_hits"] + out["misses"]
+        out["hit_ratio"] = round((lookups - out["misses"]) / lookups, 3) if lookups else 0.0
+        return out
+
+    def disk_stats(self) -> dict:
+        now = time.time()
+        total, negative, fresh, oldest = self._db().execute(
+            "SELECT COUNT(*), SUM(negative), SUM(stored_at >= ?), MIN(stored_at) FROM off_cache",
+            (now - self.ttl,)).fetchone()
+        return {"rows": total, "negative": negative or 0, "fresh": fresh or 0,
+                "oldest_age_h": round((now - oldest) / 3600, 1) if oldest else None}
+
+# ---------- CLI ----------
+def exported_counters(path: str = metrics.JSONL_PATH) -> dict:
+    """{event: count} from the app's last metrics snapshot (CARIOCA_METRICS_JSONL), or {}."""
+    if not path or not os.path.exists(path):
+        return {}
+    last = None
+    with open(path) as f:
+        for line in f:
+            last = line
+    if not last:
+        return {}
+    return {c["labels"]["event"]: c["value"] for c in json.loads(last)["counters"]
+            if c["name"] == "off_cache_events_total"}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Inspect the OpenFoodFacts response cache")
+    ap.add_argument("cmd", choices=["stats", "prune"])
+    ap.add_argument("--db", default=CACHE_PATH)
+    args = ap.parse_args(argv)
+    cache = TieredCache(args.db)
+    if args.cmd == "prune":
+        cache.prune()
+    out = cache.disk_stats()
+    if args.cmd == "stats":
+        out["counters"] = exported_counters()
+    print(json.dumps(out, indent=2))
+
+if __name__ == "__main__":
+    main()
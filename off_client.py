@@ -0,0 +1,93 @@
+"""OpenFoodFacts lookups outside Streamlit: local index -> tiered cache -> live API,
+plus a bounded-concurrency batch runner for lookups such as the menu staples."""
+import os, threading, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+import food_index, metrics, off_cache
+
+OFF_URL = os.environ.get("CARIOCA_OFF_URL", "https://world.openfoodfacts.org/cgi/search.pl")
+REQUEST_TIMEOUT = 10.0
+MAX_WORKERS = int(os.environ.get("CARIOCA_OFF_WORKERS", 8))
+
+# ---------- HTTP session ----------
+_session = None
+_session_lock = threading.Lock()
+
+def session() -> requests.Session:
+    """Process-wide keep-alive session whose connection pool matches the batch width."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS, max_retries=0)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers["User-Agent"] = "Carioca/2 (fitness & nutrition app)"
+            _session = metrics.trace_session(s)
+        return _session
+
+def fetch(query: str, lang_code: str = "en", page_size: int = 20, timeout: float = REQUEST_TIMEOUT) -> list:
+    """Live OFF search; raises on network/HTTP errors so the cache can record a failure."""
+    params = {"search_terms":query,"search_simple":1,"action":"process","json":1,"page_size":page_size,"cc":"world"}
+    r = session().get(OFF_URL, params=params, timeout=timeout)
+    r.raise_for_status()
+    data = r.json()
+    prods = data.get("products", [])
+    rows = []
+    for p in prods:
+        nutr = p.get("nutriments", {}) or {}
+        kcal = nutr.get("energy-kcal_100g"); prot = nutr.get("proteins_100g")
+        carbs = nutr.get("carbohydrates_100g"); fat = nutr.get("fat_100g")
+        if None in (kcal, prot, carbs, fat): continue
+        name = p.get(f"product_name_{lang_code}") or p.get("product_name") or p.get(f"generic_name_{lang_code}") or p.get("generic_name") or "Unnamed"
+        brand = p.get("brands","")
+        rows.append({"name":name,"brand":brand,"kcal_100g":float(kcal),"protein_100g":float(prot),"carbs_100g":float(carbs),"fat_100g":float(fat)})
+    return rows
+
+def search(query: str, lang_code: str = "en", page_size: int = 20, cache=None, timeout: float = REQUEST_TIMEOUT) -> list:
+    """Local FTS index first (built offline by food_index.py); cached live API only on a miss."""
+    local = food_index.search(query, lang_code, page_size)
+    if local:
+        return local
+    load = lambda: fetch(query, lang_code, page_size, timeout=timeout)
+    if cache is None:
+        try:
+            return load()
+        except Exception:
+            return []
+    return cache.get(off_cache.make_key(query, lang_code, page_size), load)
+
+# ---------- Batches ----------
+def run_batch(fn, items, max_workers: int = MAX_WORKERS, deadline: float = 15.0):
+    """Apply `fn` to every item on a bounded pool, giving up on whatever is unfinished
+    when `deadline` seconds have passed. Returns ({item: result}, [items not finished])."""
+    items = list(dict.fromkeys(items))
+    results, missing = {}, []
+    if not items:
+        return results, missing
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix="off-batch")
+    futures = {pool.submit(fn, item): item for item in items}
+    end = time.monotonic() + deadline
+    pending = set(futures)
+    while pending:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for fut in done:
+            try:
+                results[futures[fut]] = fut.result()
+            except Exception:
+                missing.append(futures[fut])
+    missing.extend(futures[f] for f in pending)
+    # do not block the caller on stragglers; they finish (and warm the cache) in the background
+    pool.shutdown(wait=False, cancel_futures=True)
+    return results, missing
+
+def search_many(queries, lang_code: str = "en", page_size: int = 20, cache=None,
+                max_workers: int = MAX_WORKERS, deadline: float = 15.0):
+    """Concurrent `search` over many queries under one overall deadline."""
+    timeout = min(REQUEST_TIMEOUT, deadline)
+    return run_batch(lambda q: search(q, lang_code, page_size, cache=cache, timeout=timeout),
+                     queries, max_workers=max_workers, deadline=deadline)
@@ -0,0 +1,165 @@
+"""Plan engine: BMR / TDEE / calorie and macro targets, vectorized over many users and
+deficit scenarios at once. The app reads the stored `user_targets` rows; this module
+keeps them current.
+
+    python plan_engine.py recompute            # nightly: every row in `users`, one pass
+"""
+import argparse, sys, time
+import numpy as np
+import pandas as pd
+
+ACTIVITY_FACTORS = {"sedentary":1.2,"light":1.35,"moderate":1.55,"high":1.75,"very_high":1.95}
+DEFAULT_ACTIVITY = 1.35
+REST_FACTOR = 1.35          # rest-day TDEE multiplier on BMR
+DEFAULT_DEFICIT = 0.25
+WORKOUT_WEEKDAYS = (0, 2, 4)   # Mon/Wed/Fri; the nutrition rollup triggers (migration 4) use the same days
+WORKOUT_SHARE = len(WORKOUT_WEEKDAYS) / 7
+KCAL_PER_KG = 7700
+INPUTS = ["sex", "weight_kg", "height_cm", "age", "activity"]
+TARGET_COLS = ["bmr", "tdee", "wcal", "rcal", "p_w", "c_w", "f_w", "p_r", "c_r", "f_r"]
+
+# ---------- Formulas (arrays in, arrays out) ----------
+def mifflin_st_jeor(sex, weight, height_cm, age):
+    sex = np.asarray(sex)
+    base = 10*np.asarray(weight, float) + 6.25*np.asarray(height_cm, float) - 5*np.asarray(age, float)
+    return base + np.where(sex == "male", 5, -161)
+
+def activity_factor(level):
+    return pd.Series(np.atleast_1d(level), dtype=object).map(ACTIVITY_FACTORS).fillna(DEFAULT_ACTIVITY).to_numpy(float)
+
+def macro_split(cal, workout, weight):
+    """Protein ~2 g/kg, carbs 1.8 g/kg on workout days (0.8 on rest days), fat fills the rest."""
+    weight = np.asarray(weight, float)
+    protein_g = np.round(2.0 * weight)
+    carbs_g = np.round(np.where(workout, 1.8, 0.8) * weight)
+    fat_g = np.maximum(0, np.round((np.asarray(cal, float) - (protein_g*4 + carbs_g*4)) / 9))
+    return protein_g, carbs_g, fat_g
+
+def weekly_mean(workout, rest):
+    """Average daily TDEE over a week of WORKOUT_WEEKDAYS workout days and rest days."""
+    return WORKOUT_SHARE * np.asarray(workout, float) + (1 - WORKOUT_SHARE) * np.asarray(rest, float)
+
+# ---------- Batch targets ----------
+def energy(users: pd.DataFrame, tdee=None):
+    """(bmr, workout-day TDEE, rest-day TDEE) per row. `tdee`, a measured TDEE per row (NaN
+    where unknown, see tdee_estimator), is an average over the whole week: both day types are
+    scaled, keeping their ratio, so that their weekly mean equals it."""
+    bmr = mifflin_st_jeor(users["sex"], users["weight_kg"], users["height_cm"], users["age"])
+    workout = bmr * activity_factor(users["activity"].to_numpy())
+    rest = bmr * REST_FACTOR
+    if tdee is not None:
+        tdee = np.asarray(tdee, float)
+        scale = np.where(np.isnan(tdee), 1.0, tdee / weekly_mean(workout, rest))
+        workout, rest = workout * scale, rest * scale
+    return bmr, workout, rest
+
+def targets(users: pd.DataFrame, deficit: float = DEFAULT_DEFICIT, tdee=None) -> pd.DataFrame:
+    """Targets for every row of `users` (columns: INPUTS); same index as the input."""
+    bmr, tdee, rest = energy(users, tdee)
+    wcal = np.round(tdee * (1 - deficit))
+    rcal = np.round(rest * (1 - deficit))
+    p_w, c_w, f_w = macro_split(wcal, True, users["weight_kg"])
+    p_r, c_r, f_r = macro_split(rcal, False, users["weight_kg"])
+    return pd.DataFrame({"bmr": bmr, "tdee": tdee, "tdee_rest": rest, "wcal": wcal, "rcal": rcal, "p_w": p_w,
+                         "c_w": c_w, "f_w": f_w, "p_r": p_r, "c_r": c_r, "f_r": f_r}, index=users.index)
+
+def deficit_scenarios(users: pd.DataFrame, deficits, weeks: int = 12, tdee=None) -> pd.DataFrame:
+    """Users x deficits x day type: target calories, weekly loss and projected weight."""
+    _, workout, rest = energy(users, tdee)
+    deficits = np.asarray(deficits, float)
+    frames = []
+    for day, base in (("workout", np.asarray(workout, float)), ("rest", np.asarray(rest, float))):
+        b = base[:, None]
+        target_cal = np.round(b * (1 - deficits[None, :] / 100))
+        weekly_loss = np.round((b - target_cal) * 7 / KCAL_PER_KG, 2)
+        weight_end = np.round(users["weight_kg"].to_numpy(float)[:, None] - weekly_loss * weeks, 1)
+        frames.append(pd.DataFrame({
+            "user": np.repeat(users.index.to_numpy(), len(deficits)), "day_type": day,
+            "deficit": np.tile(deficits, len(users)), "base_tdee": np.repeat(base, len(deficits)),
+            "target_cal": target_cal.ravel(), "weekly_loss": weekly_loss.ravel(), "weight_end": weight_end.ravel()}))
+    return pd.concat(frames, ignore_index=True)
+
+def inputs_key(sex, weight_kg, height_cm, age, activity) -> str:
+    """Fingerprint of the profile fields targets depend on; stale rows fail to match it."""
+    return f"{sex}|{float(weight_kg):.1f}|{float(height_cm):.1f}|{int(age)}|{activity}"
+
+def targets_for(sex, weight_kg, height_cm, age, activity, tdee: float = None) -> dict:
+    """Single-profile convenience wrapper in the shape the app renders."""
+    users = pd.DataFrame([dict(zip(INPUTS, (sex, weight_kg, height_cm, age, activity)))])
+    row = targets(users, tdee=None if tdee is None else [tdee]).iloc[0]
+    return as_plan(row)
+
+def as_plan(row) -> dict:
+    """`tdee` is the workout-day TDEE; `tdee_mean` its weekly average with rest days. Stored
+    rows carry no `tdee_rest`: they are always formula targets, so rest is BMR * REST_FACTOR."""
+    rest = row.get("tdee_rest", row["bmr"] * REST_FACTOR)
+    return {"bmr": float(row["bmr"]), "tdee": float(row["tdee"]),
+            "tdee_mean": float(weekly_mean(row["tdee"], rest)), "wcal": int(row["wcal"]), "rcal": int(row["rcal"]),
+            "macros_w": (int(row["p_w"]), int(row["c_w"]), int(row["f_w"])),
+            "macros_r": (int(row["p_r"]), int(row["c_r"]), int(row["f_r"]))}
+
+# ---------- Storage ----------
+UPSERT = f"""INSERT INTO user_targets(username, inputs, {', '.join(TARGET_COLS)}, computed_at)
+    VALUES(?, ?, {', '.join('?' * len(TARGET_COLS))}, ?)
+    ON CONFLICT(username) DO UPDATE SET inputs=excluded.inputs,
+        {', '.join(f'{c}=excluded.{c}' for c in TARGET_COLS)}, computed_at=excluded.computed_at"""
+SELECT = f"SELECT inputs, {', '.join(TARGET_COLS)} FROM user_targets WHERE username=?"
+DEFAULTS = {"sex": "male", "weight_kg": 94.0, "height_cm": 180, "age": 34, "activity": "light"}
+
+def inputs_keys(users: pd.DataFrame) -> pd.Series:
+    """Vectorized `inputs_key` over a frame of profiles."""
+    fmt = lambda col: users[col].astype(float).map("{:.1f}".format).astype(str)
+    return (users["sex"].astype(str) + "|" + fmt("weight_kg") + "|" + fmt("height_cm") + "|"
+            + users["age"].astype(float).astype(int).astype(str) + "|" + users["activity"].astype(str))
+
+def store(conn, users: pd.DataFrame, t: pd.DataFrame):
+    """Upsert computed targets; `users` is indexed by username."""
+    if users.empty:
+        return
+    out = t[TARGET_COLS].astype(float)
+    out.insert(0, "inputs", inputs_keys(users))
+    out.insert(0, "username", users.index)
+    out["computed_at"] = pd.Timestamp.now("UTC").isoformat()
+    conn.executemany(UPSERT, zip(*(out[c].tolist() for c in out.columns)))
+
+def load(conn, username: str, expected_inputs: str):
+    """Stored plan for `username`, or None if missing or computed from other inputs."""
+    row = conn.execute(SELECT, (username,)).fetchone()
+    if row is None or row[0] != expected_inputs:
+        return None
+    return as_plan(dict(zip(TARGET_COLS, row[1:])))
+
+def recompute_all(conn, chunk_rows: int = 100_000, force: bool = False) -> tuple:
+    """Recompute targets for every user (profile gaps take the app's defaults) and store the
+    rows whose inputs changed since the last run, or all of them with `force`.
+    Returns (users scanned, rows written)."""
+    scanned = written = 0
+    sql = ("SELECT u.username, " + ", ".join(f"u.{c}" for c in INPUTS) + ", t.inputs AS stored"
+           " FROM users u LEFT JOIN user_targets t ON t.username = u.username")
+    for users in pd.read_sql_query(sql, conn, index_col="username", chunksize=chunk_rows):
+        stored = users.pop("stored")
+        users = users.fillna(DEFAULTS).infer_objects()
+        if not force:
+            users = users[inputs_keys(users).to_numpy() != stored.to_numpy()]
+        with conn:
+            store(conn, users, targets(users))
+        scanned += len(stored)
+        written += len(users)
+    return scanned, written
+
+# ---------- CLI ----------
+def main(argv=None):
+    import db
+    ap = argparse.ArgumentParser(description="Carioca plan engine")
+    ap.add_argument("cmd", choices=["recompute"])
+    ap.add_argument("--db", default=db.DB_PATH)
+    ap.add_argument("--force", action="store_true", help="rewrite every row, not just changed profiles")
+    args = ap.parse_args(argv)
+    db.Database(args.db)               # make sure the schema is current
+    conn = db.connect(args.db)
+    t0 = time.perf_counter()
+    scanned, written = recompute_all(conn, force=args.force)
+    print(f"scanned {scanned:,} users, stored {written:,} changed targets in {time.perf_counter()-t0:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
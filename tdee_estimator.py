@@ -0,0 +1,167 @@
+"""Adaptive TDEE: a two-state Kalman filter per user over logged intake and weigh-ins.
+
+State is (true weight kg, TDEE kcal/day). Each day's intake moves the weight by
+(intake - TDEE) / KCAL_PER_KG, each weigh-in corrects both, and TDEE drifts slowly. The
+state and its covariance are stored in `tdee_state`, so a new day costs one filter step
+instead of a refit; `recompute` runs the same step for every user at once, one numpy
+pass per day.
+
+    python tdee_estimator.py recompute         # nightly or after bulk imports: every user
+"""
+import argparse, sys, time
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import db, nutrition_history, plan_engine
+
+KCAL_PER_KG = plan_engine.KCAL_PER_KG
+WEIGH_VAR = 0.8 ** 2          # scale noise: water, gut content, time of day (kg^2)
+WEIGHT_DRIFT_VAR = 0.02       # per-day process noise on true weight (kg^2)
+UNLOGGED_VAR = 0.3 ** 2       # extra weight uncertainty for a day with no usable intake
+TDEE_DRIFT_VAR = 10.0 ** 2    # per-day random walk of TDEE (kcal^2)
+PRIOR_TDEE_VAR = 400.0 ** 2   # confidence in the formula TDEE we start from
+MIN_LOGGED_KCAL = 800         # lighter days are taken as partly logged and skipped
+# the estimate replaces the formula once it has this much behind it
+MIN_INTAKE_DAYS = 14
+MIN_WEIGH_INS = 7
+MAX_SD = 200.0                # half the prior's spread
+USER_CHUNK = 2_000
+STATE_COLS = ["weight", "tdee", "p_ww", "p_wt", "p_tt", "intake_days", "weigh_ins"]
+
+# ---------- Filter (arrays over users) ----------
+def initial(prior_tdee) -> dict:
+    """Fresh state per user: weight unknown until the first weigh-in, TDEE at the formula prior."""
+    prior = np.atleast_1d(np.asarray(prior_tdee, float))
+    n = len(prior)
+    return {"weight": np.full(n, np.nan), "tdee": prior.copy(), "p_ww": np.zeros(n), "p_wt": np.zeros(n),
+            "p_tt": np.full(n, PRIOR_TDEE_VAR), "intake_days": np.zeros(n, int), "weigh_ins": np.zeros(n, int)}
+
+def step(s: dict, intake: np.ndarray, weighed: np.ndarray) -> dict:
+    """One day for every user: correct with that morning's weigh-in, then predict through the
+    day's intake. NaN means no weigh-in / no usable intake that day."""
+    w, t, p_ww, p_wt, p_tt = s["weight"], s["tdee"], s["p_ww"], s["p_wt"], s["p_tt"]
+    # correct
+    seen = ~np.isnan(weighed)
+    first = seen & np.isnan(w)
+    upd = seen & ~first
+    gain = np.where(upd, 1.0 / (p_ww + WEIGH_VAR), 0.0)
+    k_w, k_t = p_ww * gain, p_wt * gain
+    resid = np.where(upd, weighed - w, 0.0)
+    w = np.where(first, weighed, w + k_w * resid)
+    t = t + k_t * resid
+    p_tt = p_tt - k_t * p_wt
+    p_ww, p_wt = (1 - k_w) * p_ww, (1 - k_w) * p_wt
+    p_ww = np.where(first, WEIGH_VAR, p_ww)
+    # predict
+    live = ~np.isnan(w)
+    logged = live & ~np.isnan(intake) & (np.nan_to_num(intake) >= MIN_LOGGED_KCAL)
+    f = np.where(logged, -1.0 / KCAL_PER_KG, 0.0)
+    w = np.where(logged, w + (np.nan_to_num(intake) - t) / KCAL_PER_KG, w)
+    p_ww = np.where(live, p_ww + 2 * f * p_wt + f * f * p_tt + WEIGHT_DRIFT_VAR + np.where(logged, 0.0, UNLOGGED_VAR), p_ww)
+    p_wt = p_wt + f * p_tt
+    p_tt = np.where(live, p_tt + TDEE_DRIFT_VAR, p_tt)
+    return {"weight": w, "tdee": t, "p_ww": p_ww, "p_wt": p_wt, "p_tt": p_tt,
+            "intake_days": s["intake_days"] + logged, "weigh_ins": s["weigh_ins"] + seen}
+
+def run(s: dict, intake: np.ndarray, weighed: np.ndarray) -> dict:
+    """Advance state over [users, days] intake and weigh-in matrices."""
+    for d in range(intake.shape[1]):
+        s = step(s, intake[:, d], weighed[:, d])
+    return s
+
+def usable(est) -> bool:
+    return (est is not None and est["intake_days"] >= MIN_INTAKE_DAYS and est["weigh_ins"] >= MIN_WEIGH_INS
+            and est["sd"] <= MAX_SD)
+
+def _estimate(s: dict, i: int, through: str) -> dict:
+    return {"tdee": float(s["tdee"][i]), "sd": float(np.sqrt(max(s["p_tt"][i], 0.0))),
+            "weight": None if np.isnan(s["weight"][i]) else float(s["weight"][i]),
+            "intake_days": int(s["intake_days"][i]), "weigh_ins": int(s["weigh_ins"][i]), "through": through}
+
+def _store(conn, usernames, s: dict, through: str):
+    now = pd.Timestamp.now("UTC").isoformat()
+    cols = [s[c].tolist() for c in STATE_COLS]
+    conn.executemany(db.TDEE_STATE_UPSERT, ((u, through, *(None if isinstance(v, float) and np.isnan(v) else v
+                                                          for v in vals), now)
+                                            for u, *vals in zip(usernames, *cols)))
+
+def _matrix(df: pd.DataFrame, users, days, col) -> np.ndarray:
+    """[users, days] array of `col` from long (username, dt, col) rows; NaN where missing."""
+    out = np.full((len(users), len(days)), np.nan)
+    if len(df):
+        ui = pd.Index(users).get_indexer(df["username"])
+        di = pd.Index(days).get_indexer(df["dt"])
+        ok = (ui >= 0) & (di >= 0)
+        out[ui[ok], di[ok]] = df[col].to_numpy(float)[ok]
+    return out
+
+# ---------- One user, incremental ----------
+def update(conn, username: str, prior_tdee: float, today: date = None) -> dict:
+    """Fold the days since the stored state (up to yesterday; today's log is still open) and
+    return the estimate. Usually zero or one filter step."""
+    through = ((today or date.today()) - timedelta(days=1)).isoformat()
+    row = conn.execute(db.TDEE_STATE, (username,)).fetchone()
+    if row is None:
+        s, since = initial(prior_tdee), "0000-00-00"
+    else:
+        since = row[0]
+        s = {c: np.array([np.nan if v is None else v], dtype=int if c in ("intake_days", "weigh_ins") else float)
+             for c, v in zip(STATE_COLS, row[1:])}
+    if since >= through:
+        return _estimate(s, 0, since)
+    intake = pd.DataFrame(conn.execute(db.TDEE_INTAKE, (username, since, through)).fetchall(), columns=["dt", "kcal"])
+    weighed = pd.DataFrame(conn.execute(db.TDEE_WEIGHTS, (username, since, through)).fetchall(), columns=["dt", "weight"])
+    if row is None:
+        if intake.empty and weighed.empty:
+            return _estimate(s, 0, since)
+        since = (date.fromisoformat(min(intake["dt"].min() if len(intake) else through,
+                                        weighed["dt"].min() if len(weighed) else through)) - timedelta(days=1)).isoformat()
+    days = pd.date_range(date.fromisoformat(since) + timedelta(days=1), through).strftime("%Y-%m-%d")
+    intake["username"] = weighed["username"] = username
+    s = run(s, _matrix(intake, [username], days, "kcal"), _matrix(weighed, [username], days, "weight"))
+    with conn:
+        _store(conn, [username], s, through)
+    return _estimate(s, 0, through)
+
+# ---------- All users, batch ----------
+def recompute_all(conn, today: date = None, chunk_users: int = USER_CHUNK) -> int:
+    """Refit every user from their full history, `chunk_users` users per vectorized pass.
+    Returns the number of users stored."""
+    nutrition_history.refresh(conn)
+    through = ((today or date.today()) - timedelta(days=1)).isoformat()
+    users = pd.read_sql_query("SELECT username, " + ", ".join(plan_engine.INPUTS) + " FROM users ORDER BY username",
+                              conn, index_col="username")
+    users = users.fillna(plan_engine.DEFAULTS).infer_objects()
+    written = 0
+    for i in range(0, len(users), chunk_users):
+        part = users.iloc[i:i + chunk_users]
+        names = part.index.tolist()
+        marks = ",".join("?" * len(names))
+        intake = pd.read_sql_query(f"SELECT username, dt, kcal FROM daily_nutrition WHERE username IN ({marks}) AND dt <= ?",
+                                   conn, params=(*names, through))
+        weighed = pd.read_sql_query(f"SELECT username, dt, AVG(weight) AS weight FROM weights WHERE username IN ({marks})"
+                                    " AND dt <= ? GROUP BY username, dt", conn, params=(*names, through))
+        first = min(intake["dt"].min() if len(intake) else through, weighed["dt"].min() if len(weighed) else through)
+        days = pd.date_range(first, through).strftime("%Y-%m-%d")
+        s = run(initial(plan_engine.weekly_mean(*plan_engine.energy(part)[1:])), _matrix(intake, names, days, "kcal"),
+                _matrix(weighed, names, days, "weight"))
+        with conn:
+            _store(conn, names, s, through)
+        written += len(names)
+    return written
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Carioca adaptive TDEE")
+    ap.add_argument("cmd", choices=["recompute"])
+    ap.add_argument("--db", default=db.DB_PATH)
+    ap.add_argument("--chunk-users", type=int, default=USER_CHUNK)
+    args = ap.parse_args(argv)
+    db.Database(args.db)
+    conn = db.connect(args.db)
+    t0 = time.perf_counter()
+    n = recompute_all(conn, chunk_users=args.chunk_users)
+    print(f"refit {n:,} users in {time.perf_counter()-t0:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Weight history for the Progress chart: date-windowed reads, vectorized trend lines and
+LTTB downsampling to a fixed point budget, so the chart payload does not grow with history."""
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import db
+
+POINT_BUDGET = 240
+TREND_WARMUP_DAYS = 30      # extra history read before the window so trends start settled
+WINDOWS = {"30d": 30, "90d": 90, "1y": 365, "all": None}
+
+def window_bounds(window: str, today: date = None):
+    today = today or date.today()
+    days = WINDOWS.get(window)
+    start = date.min if days is None else today - timedelta(days=days)
+    return start, today
+
+def load(conn, username: str, start: date, end: date) -> pd.DataFrame:
+    """Rows in [start - warm-up, end], served by the (username, dt) index."""
+    lo = start if start == date.min else start - timedelta(days=TREND_WARMUP_DAYS)
+    return pd.read_sql_query(db.WEIGHT_WINDOW, conn, params=(username, lo.isoformat(), end.isoformat()))
+
+def with_trends(df: pd.DataFrame) -> pd.DataFrame:
+    """Daily-collapsed weights plus a 7-day rolling mean and a 7-day half-life EMA."""
+    df = df.assign(dt=pd.to_datetime(df["dt"]), weight=df["weight"].astype(float))
+    df = df.groupby("dt", as_index=False)["weight"].mean()
+    s = df.set_index("dt")["weight"]
+    df["avg7"] = s.rolling("7D").mean().to_numpy()
+    df["ema"] = s.ewm(halflife="7D", times=s.index).mean().to_numpy()
+    return df
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of `n_out` points that keep the series' shape."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)       # n_out - 2 inner buckets
+    out = np.empty(n_out, dtype=int)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt_lo, nxt_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        cx, cy = x[nxt_lo:nxt_hi].mean(), y[nxt_lo:nxt_hi].mean()
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+def chart_frame(df: pd.DataFrame, start: date, budget: int = POINT_BUDGET) -> pd.DataFrame:
+    """Trend-annotated window clipped to `start`, downsampled to at most `budget` points."""
+    if df.empty:
+        return df
+    df = with_trends(df)
+    if start != date.min:
+        df = df[df["dt"] >= pd.Timestamp(start)].reset_index(drop=True)
+    if len(df) > budget:
+        x = df["dt"].to_numpy("datetime64[s]").astype(np.int64).astype(float)
+        df = df.iloc[lttb(x, df["weight"].to_numpy(float), budget)].reset_index(drop=True)
+    return df
@@ -0,0 +1,179 @@
+"""Workout plans from the declarative catalog in workouts.json, validated once at startup and
+rendered to one markdown block per (plan, training days, language).
+
+A plan is either a list of sessions (title lang key, weekdays 0=Mon, rest_day flag, and
+[exercise, prescription] pairs) or a `program`: a multi-week progressive overload table
+generated from a sessions plan. Adding a plan is a catalog edit plus its lang keys.
+
+    python workout_catalog.py check            # validate workouts.json against both lang files
+"""
+import argparse, json, re, sys
+
+CATALOG_PATH = "workouts.json"
+LANG_PATHS = {"en": "lang_en.json", "tr": "lang_tr.json"}
+FALLBACK_PLAN = "cardio_core"       # shown for a stored plan_type the catalog no longer has
+SETS_REPS = re.compile(r"^(\d+)x(\d+)$")
+PROGRAM_KEYS = {"base": str, "weeks": int, "deload_every": int, "rep_step": int, "rep_cap": int, "load_step_pct": (int, float)}
+
+# ---------- Loading ----------
+def validate(catalog: dict, langs: dict = None) -> list:
+    """Every problem found in `catalog` (empty when valid). With `langs`, also checks that each
+    plan and session title has a translation in every language."""
+    errors = []
+    videos = catalog.get("videos")
+    plans = catalog.get("plans")
+    if not isinstance(videos, dict) or not all(isinstance(u, str) and u.startswith("https://") for u in videos.values()):
+        errors.append("videos: expected {exercise: https URL}")
+        videos = {}
+    if not isinstance(plans, dict) or not plans:
+        return errors + ["plans: expected a non-empty object"]
+    if FALLBACK_PLAN not in plans:
+        errors.append(f"plans: {FALLBACK_PLAN!r} is required (the fallback plan)")
+    keys = set(plans)
+    for name, plan in plans.items():
+        where = f"plans.{name}"
+        if not isinstance(plan, dict) or len({"sessions", "program"} & set(plan)) != 1:
+            errors.append(f"{where}: needs exactly one of 'sessions' or 'program'")
+        elif "program" in plan:
+            prog = plan["program"]
+            if not isinstance(prog, dict):
+                errors.append(f"{where}.program: expected an object")
+                continue
+            for k, typ in PROGRAM_KEYS.items():
+                if not isinstance(prog.get(k), typ) or isinstance(prog.get(k), bool):
+                    errors.append(f"{where}.program.{k}: missing or not {getattr(typ, '__name__', 'a number')}")
+            base = plans.get(prog.get("base"))
+            if not isinstance(base, dict) or "sessions" not in base:
+                errors.append(f"{where}.program.base: {prog.get('base')!r} is not a sessions plan")
+            if isinstance(prog.get("weeks"), int) and not 1 <= prog["weeks"] <= 52:
+                errors.append(f"{where}.program.weeks: 1-52")
+            if prog.get("deload_every") == 1:
+                errors.append(f"{where}.program.deload_every: 0 (no deloads) or at least 2")
+        elif not isinstance(plan["sessions"], list) or not plan["sessions"]:
+            errors.append(f"{where}.sessions: expected a non-empty list")
+        else:
+            for i, s in enumerate(plan["sessions"]):
+                errors += _check_session(s, f"{where}.sessions[{i}]", videos)
+                if isinstance(s, dict) and s.get("title"):
+                    keys.add(s["title"])
+    for lang, table in (langs or {}).items():
+        missing = sorted(k for k in keys if k not in table)
+        if missing:
+            errors.append(f"lang_{lang}.json: missing {', '.join(missing)}")
+    return errors
+
+def _check_session(s, where, videos) -> list:
+    if not isinstance(s, dict):
+        return [f"{where}: expected an object"]
+    errors = []
+    if set(s) - {"title", "days", "rest_day", "exercises"}:
+        errors.append(f"{where}: unknown keys {sorted(set(s) - {'title', 'days', 'rest_day', 'exercises'})}")
+    days = s.get("days", [])
+    if not isinstance(days, list) or len(set(days)) != len(days) or not all(isinstance(d, int) and 0 <= d <= 6 for d in days):
+        errors.append(f"{where}.days: distinct weekdays 0-6")
+    ex = s.get("exercises")
+    if not isinstance(ex, list) or not ex:
+        return errors + [f"{where}.exercises: expected a non-empty list"]
+    for j, e in enumerate(ex):
+        if not (isinstance(e, list) and len(e) == 2 and all(isinstance(x, str) and x for x in e)):
+            errors.append(f"{where}.exercises[{j}]: expected [name, prescription]")
+        elif e[0] not in videos:
+            errors.append(f"{where}.exercises[{j}]: no video for {e[0]!r}")
+    return errors
+
+def load(path: str = CATALOG_PATH, langs: dict = None) -> dict:
+    with open(path, encoding="utf-8") as f:
+        catalog = json.load(f)
+    errors = validate(catalog, langs)
+    if errors:
+        raise ValueError(f"{path}: " + "; ".join(errors))
+    return catalog
+
+# ---------- Programs ----------
+def progress(prescription: str, week: int, prog: dict) -> str:
+    """Week `week` (0-based) of a double-progression block: reps climb by rep_step up to
+    rep_cap, then the next block adds load_step_pct; every deload_every-th week drops a set.
+    Prescriptions that are not SETSxREPS (times, max efforts) stay as they are."""
+    m = SETS_REPS.match(prescription)
+    if not m:
+        return prescription
+    sets, reps = int(m.group(1)), int(m.group(2))
+    every = prog["deload_every"]
+    block, pos = divmod(week, every) if every else (0, week)
+    if every and pos == every - 1:
+        return f"{max(1, sets - 1)}x{reps} ↓"
+    load = block * prog["load_step_pct"]
+    return f"{sets}x{reps + min(pos * prog['rep_step'], prog['rep_cap'])}" + (f" +{load:g}%" if load else "")
+
+# ---------- Rendering ----------
+def _scheduled(sessions, training_days: int):
+    """(session, weekdays) for every session in catalog order. The `training_days` budget is
+    dealt round-robin over the dated training sessions, so each gets a day before any gets a
+    second; one left without a day is still listed, undated. Rest-day sessions keep theirs."""
+    train = [i for i, s in enumerate(sessions) if s.get("days") and not s.get("rest_day")]
+    keep, budget = dict.fromkeys(train, 0), training_days
+    for r in range(max((len(sessions[i]["days"]) for i in train), default=0)):
+        for i in train:
+            if budget > 0 and r < len(sessions[i]["days"]):
+                keep[i] += 1
+                budget -= 1
+    for i, s in enumerate(sessions):
+        days = s.get("days", [])
+        yield s, days[:keep[i]] if i in keep else days
+
+def render(catalog: dict, plan_type: str, training_days: int, t: dict) -> str:
+    """Markdown for one plan; `t` is the language table (lang_xx.json)."""
+    plans, videos = catalog["plans"], catalog["videos"]
+    plan = plans.get(plan_type) or plans[FALLBACK_PLAN]
+    prog = plan.get("program")
+    if prog:
+        plan = plans[prog["base"]]
+    day_names = t.get("days_short", "Mon,Tue,Wed,Thu,Fri,Sat,Sun").split(",")
+    link = lambda name: f"[{t.get('video_guide', 'Video')}]({videos[name]})"
+    lines, rest_heading = [], False
+    for s, days in _scheduled(plan["sessions"], training_days):
+        if s.get("rest_day") and not rest_heading:
+            lines.append(f"### {t.get('rest_cardio', 'rest_cardio')}")
+            rest_heading = True
+        title = " — ".join(x for x in (" / ".join(day_names[d] for d in days), t.get(s.get("title"), "")) if x)
+        if title:
+            lines.append(f"**{title}**")
+        if prog and not s.get("rest_day"):
+            weeks = range(prog["weeks"])
+            lines.append("")
+            lines.append(f"| {t.get('exercise', 'Exercise')} | " + " | ".join(f"{t.get('week_short', 'W')}{w + 1}" for w in weeks) + " |")
+            lines.append("|---" * (len(weeks) + 1) + "|")
+            lines += [f"| **{name}** {link(name)} | " + " | ".join(progress(rx, w, prog) for w in weeks) + " |"
+                      for name, rx in s["exercises"]]
+        else:
+            lines += [f"- **{name}** — {rx}  |  {link(name)}" for name, rx in s["exercises"]]
+        lines.append("")
+    if prog:
+        lines.append(f"_{t.get('progression_note', '')}_")
+    return "\n".join(lines)
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Carioca workout catalog")
+    ap.add_argument("cmd", choices=["check", "render"])
+    ap.add_argument("--catalog", default=CATALOG_PATH)
+    ap.add_argument("--plan", default="full_body")
+    ap.add_argument("--days", type=int, default=5)
+    ap.add_argument("--lang", default="en", choices=list(LANG_PATHS))
+    args = ap.parse_args(argv)
+    langs = {}
+    for lang, path in LANG_PATHS.items():
+        with open(path, encoding="utf-8") as f:
+            langs[lang] = json.load(f)
+    try:
+        catalog = load(args.catalog, langs)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if args.cmd == "render":
+        print(render(catalog, args.plan, args.days, langs[args.lang]))
+    else:
+        print(f"{args.catalog}: {len(catalog['plans'])} plans OK", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
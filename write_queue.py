@@ -0,0 +1,152 @@
+"""Write-behind queue: one writer thread per process applies queued inserts/updates in
+batched transactions, so clicks do not each pay for a commit on the shared write lock.
+
+`submit()` returns a Future that resolves once the unit's transaction has committed,
+which is how a session learns its write is durable (or why it failed).
+"""
+import atexit, queue, threading, time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+import db, metrics
+
+BATCH_MAX = 500        # queued units per transaction
+LINGER = 0.02          # seconds to wait for more units before committing a batch
+
+_STOP = object()
+
+def _settle(fut: Future, exc: BaseException = None):
+    if fut.done():      # cancelled by its session
+        return
+    if exc is None:
+        fut.set_result(True)
+    else:
+        fut.set_exception(exc)
+
+def grouped(units) -> list:
+    """[(sql, [params, ...])] for a batch of units, grouped by SQL across the batch so each
+    statement kind is one executemany. Each unit's statements keep their order, and so do
+    statements with the same SQL; only unrelated statements of different units move."""
+    units = [deque(u) for u in units if u]
+    runs = []
+    while units:
+        sql = units[0][0][0]
+        runs.append((sql, [u.popleft()[1] for u in units if u[0][0] == sql]))
+        units = [u for u in units if u]
+    return runs
+
+class WriteQueue:
+    """`batch_hook(conn)` is a context manager entered around each batch's statements, inside
+    its transaction; the app folds the nutrition rollups there once per batch."""
+    def __init__(self, path: str = db.DB_PATH, batch_max: int = BATCH_MAX, linger: float = LINGER, batch_hook=None):
+        self.path, self.batch_max, self.linger = path, batch_max, linger
+        self.batch_hook = batch_hook or (lambda conn: nullcontext())
+        self._q = queue.Queue()
+        self._visible = threading.Lock()
+        self._latencies = deque(maxlen=512)     # (flush seconds, oldest wait seconds) per batch
+        self.counters = {"units": 0, "rows": 0, "batches": 0, "failed_units": 0}
+        self._thread = threading.Thread(target=self._run, name="carioca-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---------- producer side ----------
+    def submit(self, statements) -> Future:
+        """Queue one unit: a list of (sql, params) applied atomically, in order."""
+        fut = Future()
+        self._q.put((list(statements), fut, time.monotonic()))
+        return fut
+
+    @contextmanager
+    def settled(self):
+        """Hold off commits while a reader pairs a DB read with its still-pending futures,
+        so a write can never show up both in the read and in the pending list."""
+        with self._visible:
+            yield
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    def stats(self) -> dict:
+        lat = sorted(f for f, _ in self._latencies)
+        waits = sorted(w for _, w in self._latencies)
+        pct = lambda xs, p: round(xs[min(len(xs) - 1, int(p * len(xs)))] * 1000, 2) if xs else 0.0
+        return dict(self.counters, depth=self.depth(),
+                    flush_ms_p50=pct(lat, 0.5), flush_ms_p95=pct(lat, 0.95),
+                    wait_ms_p50=pct(waits, 0.5), wait_ms_p95=pct(waits, 0.95))
+
+    def close(self, timeout: float = 5.0):
+        """Flush what is queued and stop the writer."""
+        if self._thread.is_alive():
+            self._q.put(_STOP)
+            self._thread.join(timeout)
+
+    # ---------- writer thread ----------
+    def _run(self):
+        conn = db.connect(self.path)
+        conn.isolation_level = None     # explicit BEGIN/COMMIT below
+        while True:
+            first = self._q.get()
+            if first is _STOP:
+                return
+            batch, stop = [first], False
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_max:
+                try:
+                    item = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._flush(conn, batch)
+            except Exception as e:      # the writer outlives any one batch
+                for _, fut, _ in batch:
+                    _settle(fut, e)
+            if stop:
+                return
+
+    def _flush(self, conn, batch):
+        t0 = time.monotonic()
+        failed = []
+        try:
+            self._commit(conn, batch)
+        except Exception:
+            # isolate the bad unit(s): retry one transaction per unit
+            for item in batch:
+                try:
+                    self._commit(conn, [item])
+                except Exception as e:
+                    failed.append(item)
+                    _settle(item[1], e)
+        flush, wait = time.monotonic() - t0, t0 - min(i[2] for i in batch)
+        self._latencies.append((flush, wait))
+        self.counters["batches"] += 1
+        self.counters["units"] += len(batch)
+        self.counters["failed_units"] += len(failed)
+        self.counters["rows"] += sum(len(i[0]) for i in batch) - sum(len(i[0]) for i in failed)
+        if metrics.ENABLED:
+            metrics.observe("write_flush_seconds", flush)
+            metrics.observe("write_wait_seconds", wait)
+            metrics.inc("write_units_total", len(batch) - len(failed))
+            if failed:
+                metrics.inc("write_units_failed_total", len(failed))
+
+    def _commit(self, conn, batch):
+        """One transaction for the batch, one executemany per statement kind (see `grouped`),
+        inside the batch hook."""
+        runs = grouped(statements for statements, _, _ in batch)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            with self.batch_hook(conn):
+                for sql, rows in runs:
+                    conn.executemany(sql, rows)
+            with self._visible:
+                conn.execute("COMMIT")
+                for _, fut, _ in batch:
+                    _settle(fut)
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise